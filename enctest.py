@@ -34,24 +34,24 @@ async def test_register_tenant():
     except Exception as e:
         print("❌ Error in registering tenant:", str(e))
 
-def test_get_token():
+async def test_get_token():
     """Test retrieving a token from Vault."""
     print("\n[TEST] Getting Token for role:", TEST_ROLE)
     try:
-        token = vault_client.get_vault_token(TENANT_ID, TEST_ROLE)
+        token = await vault_client.get_vault_token(TENANT_ID, TEST_ROLE)
         print("✅ Vault Token:", token)
     except Exception as e:
         print("❌ Error retrieving token:", str(e))
 
-def test_encrypt_decrypt_data():
+async def test_encrypt_decrypt_data():
     """Test encrypting and decrypting a string."""
     print("\n[TEST] Encrypting Data...")
     try:
-        encrypted_text = encryption_service.encrypt_data(TENANT_ID, TEST_ROLE, PLAIN_TEXT)
+        encrypted_text = await encryption_service.encrypt_data(TENANT_ID, TEST_ROLE, PLAIN_TEXT)
         print("Encrypted Text:", encrypted_text)
 
         print("\n[TEST] Decrypting Data...")
-        decrypted_text = encryption_service.decrypt_data(TENANT_ID, TEST_ROLE, encrypted_text)
+        decrypted_text = await encryption_service.decrypt_data(TENANT_ID, TEST_ROLE, encrypted_text)
         print("Decrypted Text:", decrypted_text)
 
         assert decrypted_text == PLAIN_TEXT, "❌ Decryption failed!"
@@ -59,7 +59,7 @@ def test_encrypt_decrypt_data():
     except Exception as e:
         print("❌ Error in encryption/decryption:", str(e))
 
-def test_encrypt_decrypt_file():
+async def test_encrypt_decrypt_file():
     """Test encrypting and decrypting a file."""
     try:
         # Write plain text to test file
@@ -67,25 +67,11 @@ def test_encrypt_decrypt_file():
             f.write(PLAIN_TEXT)
 
         print("\n[TEST] Encrypting File...")
-        encrypted_text = encryption_service.encrypt_file(TENANT_ID, TEST_ROLE, TEST_FILE)
-
-        # Save encrypted content as binary to avoid encoding issues
-        with open(ENCRYPTED_FILE, "wb") as f:
-            f.write(encrypted_text.encode())  # Store as binary
-
+        await encryption_service.encrypt_file(TENANT_ID, TEST_ROLE, TEST_FILE, ENCRYPTED_FILE)
         print(f"✅ Encrypted file saved at: {ENCRYPTED_FILE}")
 
         print("\n[TEST] Decrypting File...")
-
-        # Read the encrypted file content before decryption
-        with open(ENCRYPTED_FILE, "rb") as f:
-            encrypted_text = f.read().decode()  # Read as binary, then decode
-
-        decrypted_text = encryption_service.decrypt_data(TENANT_ID, TEST_ROLE, encrypted_text)
-
-        # Write decrypted text to a file
-        with open(DECRYPTED_FILE, "w", encoding="utf-8") as f:
-            f.write(decrypted_text)
+        await encryption_service.decrypt_file(TENANT_ID, TEST_ROLE, ENCRYPTED_FILE, DECRYPTED_FILE)
 
         # Read back and verify
         with open(DECRYPTED_FILE, "r", encoding="utf-8") as f:
@@ -100,9 +86,13 @@ def test_encrypt_decrypt_file():
 
 
 
+async def main():
+    await test_register_tenant()
+    await test_get_token()
+    await test_encrypt_decrypt_data()
+    await test_encrypt_decrypt_file()
+
+
 if __name__ == "__main__":
-    asyncio.run(test_register_tenant())  # Run async function properly
-    test_get_token()
-    test_encrypt_decrypt_data()
-    test_encrypt_decrypt_file()
+    asyncio.run(main())
     print("\n✅ All tests completed successfully!")
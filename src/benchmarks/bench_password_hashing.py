@@ -0,0 +1,105 @@
+"""Measure /health latency while a login storm is running.
+
+Two variants of a login endpoint check a bcrypt hash: one calls
+``verify_password`` inline on the event loop, the other goes through the
+``password_hasher`` pool. While ``--logins`` concurrent logins hammer the
+endpoint, /health is probed every 10ms and its latency recorded. No
+database is needed.
+
+Run from ``src/``:
+
+    python -m benchmarks.bench_password_hashing --logins 200 --concurrency 50
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+from fastapi import FastAPI, HTTPException
+
+from core.metrics import metrics
+from core.security import get_password_hash, verify_password, verify_password_async, password_hasher
+
+PASSWORD = "correct horse battery staple"
+HEALTH_INTERVAL = 0.01
+
+
+def build_app(password_hash: str, off_loop: bool) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/health")
+    async def health_check():
+        return {"status": "ok"}
+
+    @app.post("/login")
+    async def login():
+        if off_loop:
+            valid = await verify_password_async(PASSWORD, password_hash)
+        else:
+            valid = verify_password(PASSWORD, password_hash)
+        if not valid:
+            raise HTTPException(401, "Invalid credentials")
+        return {"status": "ok"}
+
+    return app
+
+
+async def run_storm(app: FastAPI, logins: int, concurrency: int) -> dict:
+    health_latencies = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://localhost") as client:
+        queue = iter(range(logins))
+        storm_end = None
+
+        async def login_worker():
+            for _ in queue:
+                response = await client.post("/login")
+                assert response.status_code == 200, response.text
+
+        async def health_poller():
+            # Latency is measured from when each probe was due, so a probe
+            # held up behind a blocked event loop counts the whole stall.
+            # Probes that fell due during the storm are all sent, late.
+            due = time.perf_counter()
+            while storm_end is None or due < storm_end:
+                await asyncio.sleep(max(due - time.perf_counter(), 0))
+                response = await client.get("/health")
+                health_latencies.append(time.perf_counter() - due)
+                assert response.status_code == 200, response.text
+                due += HEALTH_INTERVAL
+
+        poller = asyncio.create_task(health_poller())
+        started = time.perf_counter()
+        await asyncio.gather(*(login_worker() for _ in range(concurrency)))
+        storm_end = time.perf_counter()
+        elapsed = storm_end - started
+        await poller
+
+    health_latencies.sort()
+    return {
+        "logins_per_s": logins / elapsed,
+        "health_samples": len(health_latencies),
+        "health_p50_ms": statistics.median(health_latencies) * 1000,
+        "health_p99_ms": health_latencies[max(int(len(health_latencies) * 0.99) - 1, 0)] * 1000,
+    }
+
+
+async def main(logins: int, concurrency: int):
+    password_hash = get_password_hash(PASSWORD)
+    print(f"password_hasher: {password_hasher.workers} {password_hasher.executor_kind} workers")
+    print(f"{'variant':<12} {'logins/s':>9} {'/health n':>10} {'p50 ms':>9} {'p99 ms':>9}")
+    for name, off_loop in (("inline", False), ("off-loop", True)):
+        result = await run_storm(build_app(password_hash, off_loop), logins, concurrency)
+        print(f"{name:<12} {result['logins_per_s']:>9.1f} {result['health_samples']:>10} "
+              f"{result['health_p50_ms']:>9.2f} {result['health_p99_ms']:>9.2f}")
+    print("max queue depth:", metrics.gauge("auth.password.queue_depth").max)
+    password_hasher.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args.logins, args.concurrency))
@@ -0,0 +1,158 @@
+"""Compare the pure ASGI TenantMiddleware with a BaseHTTPMiddleware version.
+
+Both variants resolve tenants through the same ``resolve_tenant`` helper and
+the tenant cache is pre-warmed, so the numbers isolate middleware overhead.
+No database is needed.
+
+Throughput and latency are measured separately. Throughput runs
+``--concurrency`` clients in process. Latency runs one request at a time:
+with concurrent in-process clients, a request's time would include
+whatever time the others held the event loop. The pure ASGI path never
+yields, but the BaseHTTPMiddleware path does, so its percentiles would
+absorb the queueing and the two would not compare like for like.
+
+Run from ``src/``:
+
+    python -m benchmarks.bench_tenant_middleware --requests 5000 --concurrency 50
+
+For latency under real concurrency, serve one variant with uvicorn and
+point an external load generator at it, e.g.:
+
+    python -m benchmarks.bench_tenant_middleware --serve asgi --port 8001
+    wrk -t2 -c50 -d30s --latency -H "Host: benchtenant.mydummy.local" http://127.0.0.1:8001/tenant-ping
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.middleware import Middleware
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import JSONResponse
+
+from core.config import settings
+from core.database import tenant_schema
+from core.middleware import TenantMiddleware, is_public_host, resolve_tenant, tenant_context
+from core.models.public import Tenant
+from core.tenant_cache import tenant_cache, subdomain_key
+
+BENCH_SUBDOMAIN = "benchtenant"
+
+
+class BaseHTTPTenantMiddleware(BaseHTTPMiddleware):
+    """The previous BaseHTTPMiddleware-based implementation, for comparison."""
+
+    async def dispatch(self, request: Request, call_next):
+        host = request.headers.get("host", "").split(":")[0]
+        request.state.is_public = False
+        if is_public_host(host):
+            request.state.is_public = True
+        else:
+            tenant = await resolve_tenant(host)
+            if not tenant:
+                return JSONResponse({"detail": "Tenant not found"}, status_code=404)
+            request.state.tenant = tenant
+            tenant_schema.set(f"tenant_{tenant.id}")
+            tenant_context.set(tenant.id)
+        return await call_next(request)
+
+
+def build_app(middleware_class) -> FastAPI:
+    app = FastAPI(middleware=[Middleware(middleware_class)])
+
+    @app.get("/health")
+    async def health_check():
+        return {"status": "ok"}
+
+    @app.get("/tenant-ping")
+    async def tenant_ping(request: Request):
+        return {"tenant": request.state.tenant.id, "schema": tenant_schema.get()}
+
+    return app
+
+
+def warm_tenant_cache():
+    tenant = Tenant(id=1, name="Bench", subdomain=BENCH_SUBDOMAIN, is_active=True)
+    tenant_cache.set(subdomain_key(BENCH_SUBDOMAIN), tenant)
+
+
+async def throughput(app: FastAPI, host: str, path: str, total: int, concurrency: int) -> float:
+    """Requests per second with ``concurrency`` clients sharing the event loop."""
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url=f"http://{host}") as client:
+        queue = iter(range(total))
+
+        async def worker():
+            for _ in queue:
+                response = await client.get(path)
+                assert response.status_code == 200, response.text
+
+        # Warm up routing and dependency caches before measuring.
+        for _ in range(50):
+            await client.get(path)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return total / (time.perf_counter() - started)
+
+
+async def latency(app: FastAPI, host: str, path: str, total: int) -> dict:
+    """p50/p99 of requests sent one at a time, so no request waits on another."""
+    latencies = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url=f"http://{host}") as client:
+        for _ in range(50):
+            await client.get(path)
+        for _ in range(total):
+            started = time.perf_counter()
+            response = await client.get(path)
+            latencies.append(time.perf_counter() - started)
+            assert response.status_code == 200, response.text
+    latencies.sort()
+    return {
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    }
+
+
+async def main(total: int, concurrency: int):
+    warm_tenant_cache()
+    targets = [
+        ("/health", settings.MAIN_DOMAIN, "/health"),
+        ("tenant route", f"{BENCH_SUBDOMAIN}.{settings.MAIN_DOMAIN}", "/tenant-ping"),
+    ]
+    variants = [
+        ("BaseHTTPMiddleware", BaseHTTPTenantMiddleware),
+        ("pure ASGI", TenantMiddleware),
+    ]
+    print(f"{'target':<14} {'middleware':<20} {f'req/s @{concurrency}':>12} "
+          f"{'p50 ms @1':>10} {'p99 ms @1':>10}")
+    for label, host, path in targets:
+        for name, middleware_class in variants:
+            rps = await throughput(build_app(middleware_class), host, path, total, concurrency)
+            result = await latency(build_app(middleware_class), host, path, total)
+            print(f"{label:<14} {name:<20} {rps:>12.0f} "
+                  f"{result['p50_ms']:>10.3f} {result['p99_ms']:>10.3f}")
+
+
+SERVE_VARIANTS = {"asgi": TenantMiddleware, "basehttp": BaseHTTPTenantMiddleware}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--serve", choices=sorted(SERVE_VARIANTS),
+                        help="serve this variant with uvicorn for an external load generator")
+    parser.add_argument("--port", type=int, default=8001)
+    args = parser.parse_args()
+    if args.serve:
+        import uvicorn
+
+        warm_tenant_cache()
+        uvicorn.run(build_app(SERVE_VARIANTS[args.serve]), host="127.0.0.1", port=args.port,
+                    log_level="warning")
+    else:
+        asyncio.run(main(args.requests, args.concurrency))
@@ -0,0 +1,82 @@
+"""Count statements and time a typical request in each tenant routing mode.
+
+A "request" here is what an authenticated tenant endpoint does: open a
+session through ``get_db``, load the user and then the user's role. Needs
+the database from ``DATABASE_URL`` and an existing tenant schema.
+
+Run from ``src/``:
+
+    python -m benchmarks.bench_tenant_routing --tenant-id 1 --requests 500
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from sqlalchemy import event, select
+
+from core.config import settings
+from core.database import engine, tenant_schema, TENANT_ROUTING_MODES
+from core.dependencies import get_db
+from core.models.tenant import User, Role
+
+
+class StatementCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+
+async def simulated_request():
+    async for db in get_db():
+        user = (await db.execute(select(User).limit(1))).scalars().first()
+        if user is not None:
+            await db.execute(select(Role).where(Role.id == user.role_id))
+        else:
+            await db.execute(select(Role).limit(1))
+
+
+async def run_mode(mode: str, total: int) -> dict:
+    settings.TENANT_ROUTING_MODE = mode
+    counter = StatementCounter()
+    event.listen(engine.sync_engine, "before_cursor_execute", counter)
+    try:
+        for _ in range(20):
+            await simulated_request()
+        counter.count = 0
+        latencies = []
+        for _ in range(total):
+            started = time.perf_counter()
+            await simulated_request()
+            latencies.append(time.perf_counter() - started)
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", counter)
+
+    latencies.sort()
+    return {
+        "statements": counter.count / total,
+        "mean_ms": statistics.fmean(latencies) * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    }
+
+
+async def main(tenant_id: int, total: int):
+    tenant_schema.set(f"tenant_{tenant_id}")
+    # Keep SQL echo out of the timings.
+    engine.sync_engine.echo = False
+    print(f"{'mode':<22} {'stmts/req':>10} {'mean ms':>9} {'p99 ms':>9}")
+    for mode in TENANT_ROUTING_MODES:
+        result = await run_mode(mode, total)
+        print(f"{mode:<22} {result['statements']:>10.1f} "
+              f"{result['mean_ms']:>9.2f} {result['p99_ms']:>9.2f}")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tenant-id", type=int, required=True)
+    parser.add_argument("--requests", type=int, default=500)
+    args = parser.parse_args()
+    asyncio.run(main(args.tenant_id, args.requests))
@@ -0,0 +1,81 @@
+"""Compare ways of encrypting a batch of fields against a slow Vault.
+
+Runs ``EncryptionService`` against ``InMemoryVault`` with ``--latency``
+seconds added to every Vault request, and times encrypting then
+decrypting ``--fields`` values: one transit call per field (sequential
+and concurrent), transit batch calls, and envelope encryption. No Vault
+server is needed.
+
+Run from ``src/``:
+
+    python -m benchmarks.bench_vault --fields 500 --latency 0.005
+"""
+import argparse
+import asyncio
+import time
+
+from core.encryption_service import DataKeyCache, EncryptionService
+from core.vault_client import AsyncVault, VaultClient, VaultTokenCache
+from core.vault_memory import InMemoryVault
+
+TENANT = "bench"
+ROLE = "clinic_admin"
+
+
+class _Role:
+    def __init__(self, name: str):
+        self.name = name
+
+
+async def per_field(service: EncryptionService, values: list) -> list:
+    encrypted = [await service.encrypt_data(TENANT, ROLE, v) for v in values]
+    return [await service.decrypt_data(TENANT, ROLE, c) for c in encrypted]
+
+
+async def per_field_concurrent(service: EncryptionService, values: list) -> list:
+    encrypted = await asyncio.gather(*(service.encrypt_data(TENANT, ROLE, v) for v in values))
+    return await asyncio.gather(*(service.decrypt_data(TENANT, ROLE, c) for c in encrypted))
+
+
+async def batch(service: EncryptionService, values: list) -> list:
+    encrypted = await service.encrypt_batch(TENANT, ROLE, values)
+    return await service.decrypt_batch(TENANT, ROLE, encrypted)
+
+
+async def envelope(service: EncryptionService, values: list) -> list:
+    encrypted = [await service.envelope_encrypt(TENANT, ROLE, v) for v in values]
+    return [await service.envelope_decrypt(TENANT, ROLE, c) for c in encrypted]
+
+
+async def main(fields: int, latency: float, connections: int):
+    backend = InMemoryVault(root_token="root", latency=latency)
+    vault = AsyncVault("http://vault", timeout=30, max_retries=0, backoff=0,
+                       max_connections=connections, transport=backend)
+    vault_client = VaultClient(vault, token="root")
+    await vault_client.register_tenant(TENANT, [_Role(ROLE)])
+    values = [f"patient note {i}" for i in range(fields)]
+
+    print(f"{fields} fields, {latency * 1000:.1f}ms per Vault request\n")
+    print(f"{'mode':<22}{'total ms':>10}{'requests':>10}")
+    for name, run in [("per field", per_field), ("per field, gathered", per_field_concurrent),
+                      ("transit batch", batch), ("envelope", envelope)]:
+        service = EncryptionService(
+            token_cache=VaultTokenCache(vault_client, renew_margin=0, check_interval=3600),
+            data_keys=DataKeyCache(ttl=3600, max_uses=1_000_000, max_size=1000),
+        )
+        service.vault_client = vault_client
+        requests_before = backend.requests
+        started = time.perf_counter()
+        assert await run(service, values) == values
+        elapsed = (time.perf_counter() - started) * 1000
+        print(f"{name:<22}{elapsed:>10.1f}{backend.requests - requests_before:>10}")
+    await vault.aclose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--fields", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.005)
+    parser.add_argument("--connections", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args.fields, args.latency, args.connections))
@@ -0,0 +1,123 @@
+from .config import settings
+from .vault_client import VaultClient
+from typing import Optional
+import base64
+import hashlib
+import hmac
+import logging
+import os
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+# Hex digits of HMAC-SHA256 kept: 128 bits, collisions are not a concern
+DIGEST_LENGTH = 32
+
+
+def normalize(value: str) -> str:
+    """"123-45-6789", "123 45 6789" and "123456789" index alike."""
+    return re.sub(r"[^0-9A-Za-z]", "", value).upper()
+
+
+def secret_path(tenant_id: str) -> str:
+    return f"tenants/{tenant_id}/blind_index"
+
+
+class BlindIndexKeys:
+    """One tenant's blind-index HMAC keys by version, and the version new values use.
+
+    Index values are "<version>:<hmac>", so rows indexed before a
+    rotation keep matching until they are reindexed.
+    """
+
+    __slots__ = ("current", "keys", "kv_version", "expires_at")
+
+    def __init__(self, current: int, keys: dict[int, bytes], kv_version: int, ttl: float):
+        self.current = current
+        self.keys = keys
+        self.kv_version = kv_version
+        self.expires_at = time.monotonic() + ttl
+
+    @classmethod
+    def from_secret(cls, data: dict, kv_version: int, ttl: float) -> "BlindIndexKeys":
+        keys = {int(version): base64.b64decode(key) for version, key in data["keys"].items()}
+        return cls(int(data["current"]), keys, kv_version, ttl)
+
+    def to_secret(self) -> dict:
+        return {
+            "current": str(self.current),
+            "keys": {str(version): base64.b64encode(key).decode() for version, key in self.keys.items()},
+        }
+
+    def digest(self, value: str, version: Optional[int] = None) -> str:
+        version = version or self.current
+        mac = hmac.new(self.keys[version], normalize(value).encode(), hashlib.sha256)
+        return f"{version}:{mac.hexdigest()[:DIGEST_LENGTH]}"
+
+    def digests(self, value: str) -> list[str]:
+        """Index values ``value`` may be stored under, one per live key version."""
+        return [self.digest(value, version) for version in sorted(self.keys)]
+
+
+class BlindIndexKeyStore:
+    """Per-tenant blind-index keys, kept in Vault KV and cached for ``ttl`` seconds.
+
+    A tenant's first key is created on first use. Writes go through KV
+    check-and-set, so workers racing to create or rotate keys cannot
+    overwrite each other. Another worker sees a rotation within ``ttl``.
+    """
+
+    def __init__(self, vault_client: VaultClient, ttl: float):
+        self.vault_client = vault_client
+        self.ttl = ttl
+        self._keys: dict[str, BlindIndexKeys] = {}
+
+    async def get(self, tenant_id: str) -> BlindIndexKeys:
+        keys = self._keys.get(tenant_id)
+        if keys is None or keys.expires_at <= time.monotonic():
+            keys = self._keys[tenant_id] = await self._load(tenant_id)
+        return keys
+
+    def invalidate(self, tenant_id: str):
+        self._keys.pop(tenant_id, None)
+
+    async def _load(self, tenant_id: str) -> BlindIndexKeys:
+        while True:
+            data, kv_version = await self.vault_client.read_secret(secret_path(tenant_id))
+            if data is not None:
+                return BlindIndexKeys.from_secret(data, kv_version, self.ttl)
+            keys = BlindIndexKeys(1, {1: os.urandom(32)}, 1, self.ttl)
+            if await self.vault_client.write_secret(secret_path(tenant_id), keys.to_secret(), cas=0):
+                return keys
+            # Another worker created the key first; use theirs.
+
+    async def _update(self, tenant_id: str, change) -> BlindIndexKeys:
+        while True:
+            self.invalidate(tenant_id)
+            keys = await self.get(tenant_id)
+            change(keys)
+            if await self.vault_client.write_secret(secret_path(tenant_id), keys.to_secret(),
+                                                    cas=keys.kv_version):
+                self.invalidate(tenant_id)
+                return keys
+
+    async def rotate(self, tenant_id: str) -> int:
+        """Add a key version and index new values with it; returns the version."""
+        def add_version(keys: BlindIndexKeys):
+            keys.current = max(keys.keys) + 1
+            keys.keys[keys.current] = os.urandom(32)
+
+        keys = await self._update(tenant_id, add_version)
+        logger.info(f"Rotated blind-index key of tenant {tenant_id} to v{keys.current}")
+        return keys.current
+
+    async def retire(self, tenant_id: str, version: int):
+        """Drop key versions older than ``version``, once no row is indexed under them."""
+        def drop_older(keys: BlindIndexKeys):
+            keys.keys = {v: key for v, key in keys.keys.items() if v >= version}
+
+        await self._update(tenant_id, drop_older)
+
+
+blind_index_keys = BlindIndexKeyStore(VaultClient(), ttl=settings.BLIND_INDEX_KEY_TTL_SECONDS)
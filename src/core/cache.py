@@ -0,0 +1,269 @@
+from collections import OrderedDict
+from .database import tenant_schema
+from .config import settings
+from .metrics import metrics
+from .invalidation import invalidation_bus, split_scoped_key
+from .redis_client import get_redis
+from typing import Any, Awaitable, Callable, Iterable, Optional
+import asyncio
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+CACHE_BACKENDS = ("memory", "redis")
+if settings.CACHE_BACKEND not in CACHE_BACKENDS:
+    raise ValueError(f"Invalid CACHE_BACKEND: {settings.CACHE_BACKEND}")
+
+# Namespace for data that is the same on every host (landing page, plans)
+PUBLIC = "public"
+
+
+class MemoryBackend:
+    """In-process LRU with per-entry expiry; the default, and what tests use.
+
+    Each entry remembers its tags, so tag memberships go when it does,
+    whether it expires, is evicted or is deleted.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, tuple[float, str, tuple[str, ...]]]" = OrderedDict()
+        self._tags: dict[str, set[str]] = {}
+
+    def _forget(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            self._forget(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    async def set(self, key: str, value: str, ttl: float, tags: Iterable[str]):
+        self._forget(key)
+        tags = tuple(tags)
+        self._entries[key] = (time.monotonic() + ttl, value, tags)
+        for tag in tags:
+            self._tags.setdefault(tag, set()).add(key)
+        while len(self._entries) > self.max_size:
+            self._forget(next(iter(self._entries)))
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            self._forget(key)
+
+    async def invalidate_tag(self, tag: str):
+        await self.delete(*self._tags.get(tag, ()))
+
+    async def clear(self):
+        self._entries.clear()
+        self._tags.clear()
+
+
+class RedisBackend:
+    """Entries in Redis under ``prefix``; each tag is a set of its entry keys."""
+
+    def __init__(self, prefix: str = "cache:"):
+        self.prefix = prefix
+
+    async def get(self, key: str) -> Optional[str]:
+        return await get_redis().get(self.prefix + key)
+
+    async def set(self, key: str, value: str, ttl: float, tags: Iterable[str]):
+        ttl = max(int(ttl), 1)
+        async with get_redis().pipeline(transaction=False) as pipe:
+            pipe.set(self.prefix + key, value, ex=ttl)
+            for tag in tags:
+                tag_key = f"{self.prefix}tag:{tag}"
+                pipe.sadd(tag_key, key)
+                # A tag set only has to outlive the entries it points at.
+                pipe.expire(tag_key, ttl, gt=True)
+                pipe.expire(tag_key, ttl, nx=True)
+            await pipe.execute()
+
+    async def delete(self, *keys: str):
+        if keys:
+            await get_redis().delete(*(self.prefix + key for key in keys))
+
+    async def invalidate_tag(self, tag: str):
+        redis = get_redis()
+        tag_key = f"{self.prefix}tag:{tag}"
+        keys = await redis.smembers(tag_key)
+        await redis.delete(tag_key, *(self.prefix + key for key in keys))
+
+    async def clear(self):
+        redis = get_redis()
+        async for key in redis.scan_iter(match=f"{self.prefix}*", count=1000):
+            await redis.delete(key)
+
+
+class Cache:
+    """Tenant-namespaced async cache of JSON-serializable values.
+
+    Keys and tags are prefixed with the current tenant schema, or with
+    ``PUBLIC`` when ``public=True``, so tenants can never read each
+    other's entries. ``get_or_compute`` is single-flight: concurrent
+    misses on one key in this process share a single computation.
+    """
+
+    def __init__(self, backend, default_ttl: float):
+        self.backend = backend
+        self.default_ttl = default_ttl
+        self._inflight: dict[str, asyncio.Task] = {}
+        self.hits = metrics.counter("cache.hits")
+        self.misses = metrics.counter("cache.misses")
+        self.errors = metrics.counter("cache.errors")
+        self._pending: set[asyncio.Task] = set()
+
+    @staticmethod
+    def _scope(public: bool) -> str:
+        return PUBLIC if public else tenant_schema.get()
+
+    def _key(self, namespace: str, key: str, public: bool) -> str:
+        return f"{self._scope(public)}:{namespace}:{key}"
+
+    def _tag(self, tag: str, public: bool) -> str:
+        return f"{self._scope(public)}:{tag}"
+
+    async def get(self, namespace: str, key: str, public: bool = False) -> Optional[Any]:
+        try:
+            raw = await self.backend.get(self._key(namespace, key, public))
+        except Exception as e:
+            # A cache outage degrades to computing every value.
+            self.errors.inc()
+            logger.warning(f"Cache get failed: {e}")
+            return None
+        return None if raw is None else json.loads(raw)
+
+    async def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None,
+                  tags: Iterable[str] = (), public: bool = False):
+        try:
+            await self.backend.set(
+                self._key(namespace, key, public),
+                json.dumps(value, default=str),
+                ttl or self.default_ttl,
+                [self._tag(tag, public) for tag in tags],
+            )
+        except Exception as e:
+            self.errors.inc()
+            logger.warning(f"Cache set failed: {e}")
+
+    async def delete(self, namespace: str, key: str, public: bool = False):
+        try:
+            await self.backend.delete(self._key(namespace, key, public))
+        except Exception as e:
+            # The write that triggered this has happened; the entry expires by TTL.
+            self.errors.inc()
+            logger.warning(f"Cache delete failed: {e}")
+
+    async def invalidate_tags(self, *tags: str, public: bool = False):
+        for tag in tags:
+            try:
+                await self.backend.invalidate_tag(self._tag(tag, public))
+            except Exception as e:
+                self.errors.inc()
+                logger.warning(f"Cache invalidation of tag {tag!r} failed: {e}")
+
+    async def get_or_compute(self, namespace: str, key: str, compute: Callable[[], Awaitable[Any]],
+                             ttl: Optional[float] = None, tags: Iterable[str] = (),
+                             public: bool = False) -> Any:
+        value = await self.get(namespace, key, public)
+        if value is not None:
+            self.hits.inc()
+            return value
+        self.misses.inc()
+
+        full_key = self._key(namespace, key, public)
+        inflight = self._inflight.get(full_key)
+        if inflight is None:
+            # The computation runs in its own task so that cancelling the
+            # request that started it does not cancel it for the others.
+            inflight = asyncio.get_running_loop().create_task(
+                self._compute(namespace, key, compute, ttl, tags, public)
+            )
+            self._inflight[full_key] = inflight
+            inflight.add_done_callback(lambda task: self._computed(full_key, task))
+        return await asyncio.shield(inflight)
+
+    async def _compute(self, namespace: str, key: str, compute: Callable[[], Awaitable[Any]],
+                       ttl: Optional[float], tags: Iterable[str], public: bool) -> Any:
+        value = await compute()
+        await self.set(namespace, key, value, ttl, tags, public)
+        return value
+
+    def _computed(self, full_key: str, task: asyncio.Task):
+        if self._inflight.get(full_key) is task:
+            del self._inflight[full_key]
+        # Waiters get the exception; mark it retrieved in case there are none.
+        if not task.cancelled():
+            task.exception()
+
+    def invalidate_on(self, bus_namespace: str, *tags: str, public: bool = False):
+        """Drop ``tags`` whenever the invalidation bus reports a change in ``bus_namespace``.
+
+        For tenant tags the schema comes from the bus key. A key of None
+        (the listener reconnected) clears the in-memory backend; Redis
+        entries are shared and were invalidated by the workers that did
+        get the message.
+        """
+        def handler(key: Optional[str]):
+            if key is None:
+                if isinstance(self.backend, MemoryBackend):
+                    self._run_soon(self.backend.clear())
+                return
+            scope = PUBLIC if public else split_scoped_key(key)[0]
+            for tag in tags:
+                self._run_soon(self.backend.invalidate_tag(f"{scope}:{tag}"))
+
+        invalidation_bus.subscribe(bus_namespace, handler)
+
+    def _run_soon(self, coro):
+        task = asyncio.get_running_loop().create_task(coro)
+        self._pending.add(task)
+        task.add_done_callback(self._invalidation_done)
+
+    def _invalidation_done(self, task: asyncio.Task):
+        self._pending.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            self.errors.inc()
+            logger.warning(f"Cache invalidation failed: {task.exception()}")
+
+
+def create_backend():
+    if settings.CACHE_BACKEND == "redis":
+        return RedisBackend()
+    return MemoryBackend(settings.CACHE_MAX_SIZE)
+
+
+cache = Cache(create_backend(), default_ttl=settings.CACHE_DEFAULT_TTL_SECONDS)
+cache.invalidate_on("plan", "plans", public=True)
+cache.invalidate_on("landing", "landing", public=True)
+cache.invalidate_on("role", "roles")
+
+
+async def cached_select(db, query, schema, *, namespace: str, key: str,
+                        ttl: Optional[float] = None, tags: Iterable[str] = (),
+                        public: bool = False) -> list:
+    """``query``'s rows dumped through ``schema``, served from the cache.
+
+    For read endpoints whose ``response_model`` is ``list[schema]``.
+    """
+    async def compute():
+        result = await db.execute(query)
+        return [schema.model_validate(row, from_attributes=True).model_dump(mode="json") for row in result.scalars().all()]
+
+    return await cache.get_or_compute(namespace, key, compute, ttl=ttl, tags=tags, public=public)
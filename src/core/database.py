@@ -1,9 +1,17 @@
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
-from sqlalchemy.orm import sessionmaker, declarative_base, declared_attr
+from sqlalchemy.orm import Session, sessionmaker, declarative_base, declared_attr
 from contextvars import ContextVar
-from sqlalchemy import text
+from sqlalchemy import event, text, Select
+from sqlalchemy.pool import NullPool
 from .config import settings
+from .metrics import metrics
+from .pool import InstrumentedQueuePool, PoolProber, CHECKOUT_WAIT_BUCKETS, pool_probing
+from typing import Optional
+from uuid import uuid4
+import asyncio
 import logging
+import random
+import time
 
 # Set up logging
 logging.basicConfig()
@@ -13,39 +21,320 @@ logger.setLevel(logging.DEBUG)
 # Contextvar for dynamic tenant schemas
 tenant_schema: ContextVar[str] = ContextVar("tenant_schema", default="public")
 
+# How tenant tables are pointed at the tenant schema:
+#   search_path          - SET search_path on the connection (session state)
+#   schema_translate_map - render tenant tables schema-qualified via the
+#                          schema_translate_map execution option; no extra
+#                          statements are sent
+#   set_local            - SET LOCAL search_path at the start of every
+#                          transaction; nothing outlives the transaction
+TENANT_ROUTING_MODES = ("search_path", "schema_translate_map", "set_local")
+if settings.TENANT_ROUTING_MODE not in TENANT_ROUTING_MODES:
+    raise ValueError(f"Invalid TENANT_ROUTING_MODE: {settings.TENANT_ROUTING_MODE}")
+
+# Behind PgBouncer in transaction pooling mode consecutive transactions may
+# run on different server connections, so session-level search_path would
+# leak between tenants.
+if settings.DB_PGBOUNCER and settings.TENANT_ROUTING_MODE == "search_path":
+    raise ValueError("DB_PGBOUNCER requires TENANT_ROUTING_MODE 'schema_translate_map' or 'set_local'")
+
+
+def engine_options() -> dict:
+    """Keyword arguments for create_async_engine shared by every engine."""
+    if settings.DB_PGBOUNCER:
+        # PgBouncer owns pooling. Prepared statements must not be cached per
+        # connection and need unique names, since a statement prepared in one
+        # transaction may be looked up on a different server connection.
+        return {
+            "poolclass": NullPool,
+            "connect_args": {
+                "statement_cache_size": 0,
+                "prepared_statement_cache_size": 0,
+                "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__",
+            },
+            "future": True,
+            "echo": settings.DB_ECHO,
+        }
+    return {
+        "poolclass": InstrumentedQueuePool,
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+        "future": True,
+        "echo": settings.DB_ECHO,
+    }
+
+
 # Engine configuration
-engine = create_async_engine(
-    str(settings.DATABASE_URL),
-    pool_size=settings.DB_POOL_SIZE,
-    max_overflow=settings.DB_MAX_OVERFLOW,
-    pool_pre_ping=True,
-    future=True,
-    echo=True,
+engine = create_async_engine(str(settings.DATABASE_URL), **engine_options())
+
+
+# --------------------------
+# Read replicas
+# --------------------------
+# Set per request by TenantMiddleware: whether the method is safe, and the
+# client's read-your-writes state (see ReadYourWrites).
+db_read_only: ContextVar[bool] = ContextVar("db_read_only", default=False)
+
+# Lag query that reads 0 on a caught-up replica even when the primary is idle
+REPLICA_LAG_SQL = text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+
+class ReplicaSet:
+    """Replica engines plus a background monitor of their replication lag.
+
+    A replica is only eligible for reads while its last measured lag is
+    below ``max_lag``; until the first probe succeeds, or when every replica
+    is lagging or down, reads fall back to the primary.
+    """
+
+    def __init__(self, urls: list, max_lag: float, check_interval: float):
+        self.engines = [create_async_engine(str(url), **engine_options()) for url in urls]
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.lag: dict[int, Optional[float]] = {i: None for i in range(len(self.engines))}
+        self._task: Optional[asyncio.Task] = None
+
+    def choose(self):
+        healthy = [
+            replica for i, replica in enumerate(self.engines)
+            if self.lag[i] is not None and self.lag[i] <= self.max_lag
+        ]
+        return random.choice(healthy) if healthy else None
+
+    def is_replica(self, sync_engine) -> bool:
+        return any(replica.sync_engine is sync_engine for replica in self.engines)
+
+    @staticmethod
+    async def _measure_lag(replica) -> float:
+        async with replica.connect() as conn:
+            return float((await conn.execute(REPLICA_LAG_SQL)).scalar())
+
+    async def check(self):
+        for i, replica in enumerate(self.engines):
+            try:
+                # Bounds the connect too: an unreachable host must not stall the monitor.
+                self.lag[i] = await asyncio.wait_for(self._measure_lag(replica), self.check_interval)
+            except Exception as e:
+                if self.lag[i] is not None:
+                    logger.warning(f"Replica {replica.url.host} unavailable: {e}")
+                self.lag[i] = None
+
+    async def _monitor(self):
+        while True:
+            await self.check()
+            await asyncio.sleep(self.check_interval)
+
+    async def start(self):
+        if self.engines and self._task is None:
+            self._task = asyncio.create_task(self._monitor())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for replica in self.engines:
+            await replica.dispose()
+
+    def stats(self) -> dict:
+        return {
+            str(replica.url.host): self.lag[i]
+            for i, replica in enumerate(self.engines)
+        }
+
+
+replicas = ReplicaSet(
+    settings.DATABASE_REPLICA_URLS,
+    max_lag=settings.REPLICA_MAX_LAG_SECONDS,
+    check_interval=settings.REPLICA_LAG_CHECK_INTERVAL,
 )
 
+
+def track_pool_occupancy(target_engine, name: str):
+    """Publish how many connections of an engine's pool are checked out."""
+    checked_out = metrics.gauge(f"db.pool.{name}.checked_out")
+    checkouts = metrics.counter(f"db.pool.{name}.checkouts")
+
+    @event.listens_for(target_engine.sync_engine, "checkout")
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        if pool_probing.get():
+            connection_record.info["probe"] = True
+            return
+        checked_out.inc()
+        checkouts.inc()
+
+    @event.listens_for(target_engine.sync_engine, "checkin")
+    def _on_checkin(dbapi_connection, connection_record):
+        if connection_record.info.pop("probe", False):
+            return
+        checked_out.dec()
+
+
+pool_prober = PoolProber(settings.DB_POOL_PROBE_INTERVAL)
+
+
+def monitor_pool(target_engine, name: str):
+    track_pool_occupancy(target_engine, name)
+    if isinstance(target_engine.pool, InstrumentedQueuePool):
+        target_engine.pool.checkout_wait = metrics.histogram(
+            f"db.pool.{name}.checkout_wait_ms", CHECKOUT_WAIT_BUCKETS
+        )
+    pool_prober.watch(target_engine, name)
+
+
+monitor_pool(engine, "primary")
+for i, replica_engine in enumerate(replicas.engines):
+    monitor_pool(replica_engine, f"replica{i}")
+
+# Cookie holding the Unix time until which a client's reads stay on the primary
+READ_YOUR_WRITES_COOKIE = "db_primary_until"
+
+
+class ReadYourWrites:
+    """One request's read-your-writes state.
+
+    A request that commits a write extends the client's primary window by
+    READ_YOUR_WRITES_SECONDS; TenantMiddleware sends the window back in
+    READ_YOUR_WRITES_COOKIE and reads it on the client's next request, so
+    it holds on whichever worker serves that request.
+    """
+
+    __slots__ = ("primary_until", "wrote")
+
+    def __init__(self, primary_until: float = 0.0):
+        # A forged cookie can only keep reads on the primary, and not for long.
+        self.primary_until = min(primary_until, time.time() + settings.READ_YOUR_WRITES_SECONDS)
+        self.wrote = False
+
+    @classmethod
+    def from_cookie(cls, value: Optional[str]) -> "ReadYourWrites":
+        try:
+            return cls(float(value)) if value else cls()
+        except ValueError:
+            return cls()
+
+    def reads_primary(self) -> bool:
+        return self.primary_until > time.time()
+
+    def mark_write(self):
+        self.primary_until = time.time() + settings.READ_YOUR_WRITES_SECONDS
+        self.wrote = True
+
+    def cookie(self) -> str:
+        max_age = int(settings.READ_YOUR_WRITES_SECONDS) + 1
+        return (f"{READ_YOUR_WRITES_COOKIE}={self.primary_until:.3f}; Max-Age={max_age}; "
+                f"Path=/; HttpOnly; SameSite=Lax")
+
+
+db_read_your_writes: ContextVar[Optional[ReadYourWrites]] = ContextVar("db_read_your_writes", default=None)
+
+
+class RoutingSyncSession(Session):
+    """Sends plain SELECTs of read-intent sessions to a replica.
+
+    Everything else goes to the primary: flushes, text statements,
+    SELECT ... FOR UPDATE/SHARE (row locks need the primary), sessions
+    that have already written, and clients that wrote within
+    READ_YOUR_WRITES_SECONDS.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        read_your_writes = db_read_your_writes.get()
+        if (
+            self.info.get("read_intent")
+            and not self._flushing
+            and not self.info.get("wrote")
+            and isinstance(clause, Select)
+            and clause._for_update_arg is None
+            and not (read_your_writes is not None and read_your_writes.reads_primary())
+        ):
+            if "replica" not in self.info:
+                # Stick to one replica for the whole session.
+                self.info["replica"] = replicas.choose()
+            replica = self.info["replica"]
+            if replica is not None:
+                return replica.sync_engine
+        return super().get_bind(mapper, clause=clause, **kw)
+
+
+@event.listens_for(Session, "after_flush")
+def _mark_session_wrote(session, flush_context):
+    session.info["wrote"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _remember_writer(session):
+    if session.info.get("wrote"):
+        read_your_writes = db_read_your_writes.get()
+        if read_your_writes is not None:
+            read_your_writes.mark_write()
+
+
 class RoutingSession(AsyncSession):
+    sync_session_class = RoutingSyncSession
+
     def __init__(self, **kwargs):
-        logger.debug("Initializing RoutingSession")
         if 'bind' not in kwargs:
             kwargs['bind'] = engine
         super().__init__(**kwargs)
     
+    async def commit(self):
+        if self.sync_session.info.get("unit_of_work"):
+            # Inside a request unit of work the real COMMIT happens once, when
+            # the request ends. Flush so ids and defaults are available now.
+            await self.flush()
+            return
+        await super().commit()
+
+    async def commit_now(self):
+        """Commit immediately, even inside a request unit of work."""
+        await super().commit()
+
     async def connection(self, **kwargs):
-        logger.debug("Getting connection from RoutingSession")
         conn = await super().connection(**kwargs)
         current_schema = tenant_schema.get()
-        logger.debug(f"Setting search_path to: {current_schema}")
-        await conn.execute(text(f"SET search_path TO {current_schema}"))
-        
-        # Verify
-        result = await conn.execute(text("SHOW search_path"))
-        actual_path = (await result.fetchone())[0]
-        logger.debug(f"Verified search_path: {actual_path}")
+        # The schema may have changed since the connection was scoped (e.g.
+        # right after a tenant schema is created); otherwise nothing to send.
+        if self.sync_session.info.get("scoped_schema") != current_schema:
+            logger.debug(f"Re-scoping connection to: {current_schema}")
+            await conn.run_sync(_apply_tenant_scope, current_schema)
+            self.sync_session.info["scoped_schema"] = current_schema
         return conn
 
+def schema_translate_map(schema: str) -> dict:
+    """Map schema-less tenant tables onto ``schema``; public tables keep theirs."""
+    return {None: schema}
+
+
+def _apply_tenant_scope(connection, schema: str):
+    if settings.TENANT_ROUTING_MODE == "schema_translate_map":
+        # Connection.execution_options() updates the connection in place.
+        connection.execution_options(schema_translate_map=schema_translate_map(schema))
+    elif settings.TENANT_ROUTING_MODE == "set_local":
+        # Reverts at COMMIT/ROLLBACK, so it is safe on a shared server connection.
+        connection.exec_driver_sql(f"SET LOCAL search_path TO {schema}")
+    else:
+        connection.exec_driver_sql(f"SET search_path TO {schema}")
+
+
+@event.listens_for(Session, "after_begin")
+def _scope_tenant_connection(session, transaction, connection):
+    # Runs when a session first uses a connection, i.e. on its first real
+    # statement, so sessions that never query never check one out.
+    schema = tenant_schema.get()
+    _apply_tenant_scope(connection, schema)
+    session.info["scoped_schema"] = schema
+
+
 # Session factory
 def get_sessionmaker():
-    logger.debug("Creating sessionmaker")
     return sessionmaker(
         class_=RoutingSession,
         bind=engine,
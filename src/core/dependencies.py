@@ -3,11 +3,15 @@ from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy import text
-from typing import AsyncGenerator
-from .database import AsyncSessionLocal, tenant_schema
+from typing import AsyncGenerator, Optional
+from .database import AsyncSessionLocal, db_read_only
 from .config import settings
-from .models.tenant import User, Role
+from .metrics import metrics
+from .models.tenant import User
+from .permissions import permission_bit
+from .principal import Principal, role_registry
+from .revocation import revocation_store
+import hmac
 import logging
 
 # Set up logging
@@ -16,22 +20,77 @@ logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl=f"{settings.API_PREFIX}/auth/login")
 
-async def get_db() -> AsyncGenerator[AsyncSession, None]:
+async def _session_scope(read_intent: bool) -> AsyncGenerator[AsyncSession, None]:
     # Create new session with current context
     session = AsyncSessionLocal()
+    # Read-intent sessions may serve SELECTs from a replica until they write.
+    session.sync_session.info["read_intent"] = read_intent
+    # No connection is checked out here: tenant scoping is applied when the
+    # first statement begins a transaction (see core.database).
     try:
-        # Explicitly set schema for this session
-        current_schema = tenant_schema.get()
-        await session.execute(text(f"SET search_path TO {current_schema}"))
         yield session
     finally:
+        if not session.sync_session.info.get("scoped_schema"):
+            metrics.counter("db.sessions.closed_without_connection").inc()
         await session.close()
 
+async def get_db() -> AsyncGenerator[AsyncSession, None]:
+    async for session in _session_scope(read_intent=db_read_only.get()):
+        yield session
+
+async def get_uow_db() -> AsyncGenerator[AsyncSession, None]:
+    """Session whose writes are committed once, atomically, when the request ends.
+
+    ``await db.commit()`` inside the handler only flushes; the single COMMIT
+    (or ROLLBACK if the handler raised) runs on exit. Depend on it with
+    ``scope="function"`` so the commit happens before the response is sent.
+    Handlers that need an intermediate commit call ``await db.commit_now()``.
+    """
+    async for session in _session_scope(read_intent=False):
+        session.sync_session.info["unit_of_work"] = True
+        try:
+            yield session
+        except Exception:
+            await session.rollback()
+            raise
+        else:
+            await session.commit_now()
+
+async def get_read_db() -> AsyncGenerator[AsyncSession, None]:
+    """Session for read-heavy endpoints; prefers a replica whatever the method."""
+    async for session in _session_scope(read_intent=True):
+        yield session
+
+async def _load_principal(db: AsyncSession, user_id: int, tenant_id: Optional[int]) -> Optional[Principal]:
+    """Principal from the database, for tokens minted without principal claims."""
+    query = select(User).where(User.id == user_id)
+    if tenant_id is None:
+        query = query.where(User.tenant_id.is_(None))
+    else:
+        query = query.where(User.tenant_id == tenant_id)
+    user = (await db.execute(query)).scalars().first()
+    if not user:
+        return None
+    role = await role_registry.resolve(db, user.role_id)
+    if not role:
+        return None
+    return Principal(user.id, user.tenant_id, role)
+
 async def get_current_user(
     request: Request,
     token: str = Depends(oauth2_scheme),
     db: AsyncSession = Depends(get_db)
-) -> User:
+) -> Principal:
+    """The caller as a Principal, resolved from the token's claims.
+
+    The role comes from ``role_registry``; the database is only read when
+    the tenant's roles are not loaded or the role's permission version
+    differs from the token's. The principal always carries the role's
+    current permissions, so a role edited after the token was issued
+    takes effect at once. Only a token whose role no longer exists is
+    rejected; moving a user to another role revokes their tokens (see
+    core.revocation).
+    """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -49,38 +108,41 @@ async def get_current_user(
             raise credentials_exception
             
         user_id = int(user_id_str)
+        tenant_id = None if token_tenant_id == "public" else int(token_tenant_id)
     except (JWTError, ValueError):
         raise credentials_exception
 
-    # Build tenant-aware query
-    query = select(User).where(User.id == user_id)
-    
-    if token_tenant_id == "public":
-        query = query.where(User.tenant_id.is_(None))
-    else:
-        try:
-            query = query.where(User.tenant_id == int(token_tenant_id))
-        except ValueError:
-            raise credentials_exception
-
-    result = await db.execute(query)
-    user = result.scalars().first()
+    # Tokens are only valid on their own tenant's host (the role is
+    # resolved in the host's schema, and no User row is read here).
+    host_tenant = getattr(request.state, "tenant", None)
+    if tenant_id != (host_tenant.id if host_tenant is not None else None):
+        raise credentials_exception
 
-    if not user:
+    if revocation_store.is_revoked(payload):
         raise credentials_exception
 
-    # Additional security check
-    if (token_tenant_id == "public" and user.tenant_id is not None) or \
-       (token_tenant_id != "public" and user.tenant_id != int(token_tenant_id)):
+    version = payload.get("pv")
+    if version is None:
+        principal = await _load_principal(db, user_id, tenant_id)
+    else:
+        role = await role_registry.resolve(
+            db, payload.get("role_id"), version, issued_at=payload.get("iat", 0)
+        )
+        if role is None:
+            raise credentials_exception
+        principal = Principal(user_id, tenant_id, role)
+
+    if not principal:
         raise credentials_exception
 
-    request.state.user = user
-    return user
+    request.state.user = principal
+    request.state.token_claims = payload
+    return principal
 
 async def get_tenant_user(
     request: Request,
-    user: User = Depends(get_current_user)
-) -> User:
+    user: Principal = Depends(get_current_user)
+) -> Principal:
     if not hasattr(request.state, "tenant"):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -95,13 +157,29 @@ async def get_tenant_user(
     
     return user
 
-async def get_current_admin(user: User = Depends(get_current_user),
-                        db: AsyncSession = Depends(get_db)
-):
-    query = select(Role).where(Role.id==user.role_id)
-    result = await db.execute(query)
-    role = result.scalars().first()
-    if role.name != "clinic_admin":
+def require_permission(permission: str):
+    """Dependency that 403s unless the tenant user's role grants ``permission``."""
+    permission_bit(permission)  # fail at import time on a typo
+
+    async def _require_permission(user: Principal = Depends(get_tenant_user)) -> Principal:
+        if not user.has(permission):
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Insufficient permissions"
+            )
+        return user
+
+    return _require_permission
+
+async def get_current_admin(
+    user: Principal = Depends(get_current_user)
+) -> Principal:
+    """An admin caller.
+
+    A user moved off the admin role or deactivated loses access at once:
+    the change revokes their tokens, which get_current_user checks.
+    """
+    if not user.has("admin"):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Admin privileges required"
@@ -111,9 +189,9 @@ async def get_current_admin(user: User = Depends(get_current_user),
 
 async def get_medical_context(
     request: Request,
-    user: User = Depends(get_current_user)
+    user: Principal = Depends(get_current_user)
 ):
-    if user.role not in ["doctor", "nurse", "admin"]:
+    if not user.has("medical.access"):
         raise HTTPException(403, "Medical staff access required")
     return user
 
@@ -129,4 +207,23 @@ def tenant_route_required(request: Request):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Tenant route not found"
-        )
\ No newline at end of file
+        )
+
+def internal_route_required(request: Request):
+    """Guard for /internal endpoints: main domain only, with INTERNAL_API_TOKEN.
+
+    Fails closed: without a configured token, only read-only endpoints
+    are served, and only with DEBUG on. State-changing endpoints (key
+    rotations, rewrap and reindex jobs) always need the token.
+    """
+    public_route_required(request)
+    token = settings.INTERNAL_API_TOKEN
+    if token:
+        allowed = hmac.compare_digest(request.headers.get("x-internal-token", ""), token)
+    else:
+        allowed = settings.DEBUG and request.method == "GET"
+    if not allowed:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Public route not found"
+        )
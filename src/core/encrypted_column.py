@@ -0,0 +1,225 @@
+from sqlalchemy import String, event, inspect
+from sqlalchemy.orm import Session
+from sqlalchemy.types import TypeDecorator
+from sqlalchemy.util import await_only
+from .blind_index import blind_index_keys
+from .config import settings
+from .database import TenantAwareBase, tenant_schema
+from .encryption_service import ENVELOPE_PREFIX, EncryptionService
+from itertools import chain
+from typing import Optional
+import asyncio
+import weakref
+
+_UNREVEALED = object()
+
+column_encryption = EncryptionService()
+
+
+def current_tenant_id() -> str:
+    schema = tenant_schema.get()
+    if not schema.startswith("tenant_"):
+        raise ValueError("Encrypted columns need a tenant schema in scope")
+    return schema[len("tenant_"):]
+
+
+def is_ciphertext(value: str) -> bool:
+    return value.startswith(("vault:v", ENVELOPE_PREFIX))
+
+
+class EncryptedValue:
+    """A stored ciphertext; ``await reveal()`` returns the plaintext.
+
+    Nothing is decrypted until the first ``reveal()``. Values loaded by
+    one session share a RevealBatch, so that reveal decrypts every value
+    the session loaded and has not revealed yet in one transit call, and
+    later reveals are free.
+    """
+
+    __slots__ = ("ciphertext", "tenant_id", "_plaintext", "_batch", "__weakref__")
+
+    def __init__(self, ciphertext: str, tenant_id: str, plaintext=_UNREVEALED):
+        self.ciphertext = ciphertext
+        self.tenant_id = tenant_id
+        self._plaintext = plaintext
+        self._batch: Optional["RevealBatch"] = None
+
+    @property
+    def revealed(self) -> bool:
+        return self._plaintext is not _UNREVEALED
+
+    async def reveal(self) -> str:
+        if not self.revealed:
+            await (self._batch or RevealBatch()).reveal(self)
+        return self._plaintext
+
+    def __repr__(self):
+        return "<EncryptedValue>"
+
+
+async def reveal(value: Optional[EncryptedValue]) -> Optional[str]:
+    """``value.reveal()`` for nullable columns."""
+    return None if value is None else await value.reveal()
+
+
+class RevealBatch:
+    """Unrevealed values of one session, decrypted together on the first reveal."""
+
+    def __init__(self, service: EncryptionService = column_encryption):
+        self.service = service
+        self._pending: list[weakref.ref] = []
+        self._running: Optional[asyncio.Future] = None
+
+    def add(self, value: EncryptedValue):
+        value._batch = self
+        self._pending.append(weakref.ref(value))
+
+    async def reveal(self, value: EncryptedValue):
+        running = self._running
+        if running is not None:
+            await asyncio.shield(running)
+            if value.revealed:
+                return
+        values = [v for v in (ref() for ref in self._pending) if v is not None and not v.revealed]
+        if not any(v is value for v in values):
+            values.append(value)
+        self._pending.clear()
+        self._running = running = asyncio.ensure_future(self._decrypt(values))
+        try:
+            await asyncio.shield(running)
+        finally:
+            if self._running is running:
+                self._running = None
+
+    async def _decrypt(self, values: list[EncryptedValue]):
+        by_tenant: dict[str, list[EncryptedValue]] = {}
+        for value in values:
+            if not is_ciphertext(value.ciphertext):
+                # Written before the column was encrypted
+                value._plaintext = value.ciphertext
+            else:
+                by_tenant.setdefault(value.tenant_id, []).append(value)
+        role = settings.ENCRYPTED_COLUMN_ROLE
+        for tenant_id, tenant_values in by_tenant.items():
+            transit = [v for v in tenant_values if not v.ciphertext.startswith(ENVELOPE_PREFIX)]
+            if transit:
+                plaintexts = await self.service.decrypt_batch(tenant_id, role, [v.ciphertext for v in transit])
+                for value, plaintext in zip(transit, plaintexts):
+                    value._plaintext = plaintext
+            for value in tenant_values:
+                if not value.revealed:
+                    # Envelope values decrypt locally once their data key is cached.
+                    value._plaintext = await self.service.envelope_decrypt(tenant_id, role, value.ciphertext)
+
+
+class EncryptedString(TypeDecorator):
+    """A string column stored encrypted under the tenant's transit key.
+
+    Assign plain ``str`` values; they are encrypted in one batch call
+    when the session flushes. Loaded values are ``EncryptedValue``s and
+    are only decrypted when revealed. Encryption and decryption run as
+    ENCRYPTED_COLUMN_ROLE; who may see a value is up to the route.
+    Plaintext cannot be used in queries or Core statements, since it
+    would reach the database unencrypted.
+
+    With ``blind_index``, the named attribute is kept set to the value's
+    keyed HMAC (see core.blind_index) on every flush, so exact matches
+    can be found with ``blind_index_match`` through an index.
+    """
+
+    impl = String
+    cache_ok = True
+
+    def __init__(self, *args, blind_index: Optional[str] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.blind_index = blind_index
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, EncryptedValue):
+            return value.ciphertext
+        raise ValueError("Plaintext for an encrypted column; assign it on a model and flush instead")
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return EncryptedValue(value, current_tenant_id())
+
+
+_encrypted_attributes: dict[type, tuple[tuple[str, Optional[str]], ...]] = {}
+
+
+def encrypted_attributes(cls) -> tuple[tuple[str, Optional[str]], ...]:
+    """(attribute, blind index attribute or None) for each EncryptedString column of ``cls``."""
+    attributes = _encrypted_attributes.get(cls)
+    if attributes is None:
+        attributes = _encrypted_attributes[cls] = tuple(
+            (attr.key, attr.columns[0].type.blind_index) for attr in inspect(cls).column_attrs
+            if isinstance(attr.columns[0].type, EncryptedString)
+        )
+    return attributes
+
+
+@event.listens_for(Session, "before_flush")
+def _encrypt_assigned_values(session, flush_context, instances):
+    pending = []
+    for obj in chain(session.new, session.dirty):
+        for key, blind_index in encrypted_attributes(type(obj)):
+            value = obj.__dict__.get(key)
+            if isinstance(value, str):
+                pending.append((obj, key, blind_index, value))
+            elif value is None and blind_index is not None and \
+                    inspect(obj).attrs[key].history.has_changes():
+                setattr(obj, blind_index, None)
+    if not pending:
+        return
+    tenant_id = current_tenant_id()
+    # Flushes of an AsyncSession run in its greenlet, so Vault calls can
+    # be awaited from this synchronous hook.
+    ciphertexts = await_only(column_encryption.encrypt_batch(
+        tenant_id, settings.ENCRYPTED_COLUMN_ROLE, [plaintext for *_, plaintext in pending]
+    ))
+    index_keys = None
+    if any(blind_index is not None for _, _, blind_index, _ in pending):
+        index_keys = await_only(blind_index_keys.get(tenant_id))
+    for (obj, key, blind_index, plaintext), ciphertext in zip(pending, ciphertexts):
+        setattr(obj, key, EncryptedValue(ciphertext, tenant_id, plaintext))
+        if blind_index is not None:
+            setattr(obj, blind_index, index_keys.digest(plaintext))
+
+
+async def blind_index_match(attribute, value: str):
+    """WHERE clause for rows whose encrypted ``attribute`` equals ``value``.
+
+    ``attribute`` is a model attribute of an EncryptedString column with
+    a blind index, e.g. ``Patient.encrypted_ssn``. The clause compares
+    the indexed column with ``value``'s HMAC under each live key
+    version, so it is one index scan, also while a reindex is running.
+    """
+    index_attribute = getattr(attribute.class_, attribute.property.columns[0].type.blind_index)
+    keys = await blind_index_keys.get(current_tenant_id())
+    return index_attribute.in_(keys.digests(value))
+
+
+def _join_reveal_batch(target, context):
+    attributes = encrypted_attributes(type(target))
+    if not attributes:
+        return
+    batch = context.session.info.get("reveal_batch")
+    if batch is None:
+        batch = context.session.info["reveal_batch"] = RevealBatch()
+    for key, _ in attributes:
+        value = target.__dict__.get(key)
+        if isinstance(value, EncryptedValue) and not value.revealed:
+            batch.add(value)
+
+
+@event.listens_for(TenantAwareBase, "load", propagate=True)
+def _on_load(target, context):
+    _join_reveal_batch(target, context)
+
+
+@event.listens_for(TenantAwareBase, "refresh", propagate=True)
+def _on_refresh(target, context, attrs):
+    _join_reveal_batch(target, context)
@@ -1,52 +1,385 @@
+import asyncio
 import base64
+import os
+import time
+import struct
+from collections import OrderedDict
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from typing import BinaryIO, Optional
 from fastapi import HTTPException
-from .vault_client import VaultClient  # Import VaultClient for token retrieval
+from .config import settings
+from .vault_client import VaultClient, VaultForbidden, vault_token_cache  # Import VaultClient for token retrieval
+
+# Envelope ciphertexts: "env:v1:<wrapped DEK, base64url>:<nonce + AES-GCM ciphertext, base64url>"
+ENVELOPE_PREFIX = "env:v1:"
+NONCE_SIZE = 12
+TAG_SIZE = 16
+
+# Encrypted files: a header, then chunks of (length, AES-GCM ciphertext).
+#   header: magic, version, chunk size, nonce prefix, wrapped key length, wrapped key
+# Chunk nonces are the file's random prefix + chunk counter + a last-chunk
+# flag, so chunks cannot be reordered, dropped or the file cut short
+# without failing authentication. The header and tenant id are the
+# authenticated data of every chunk.
+FILE_MAGIC = b"ENCF"
+FILE_VERSION = 1
+FILE_HEADER = struct.Struct(">4sBI7sH")
+CHUNK_LENGTH = struct.Struct(">I")
+CHUNK_NONCE = struct.Struct(">7sIB")
+# Largest chunk size a file header may declare; decryption reads a whole
+# chunk into memory, so a header is not trusted to set an arbitrary one.
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+
+
+def _b64e(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode()
+
+
+def _b64d(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data.encode())
+
+
+def _read_exactly(src: BinaryIO, size: int) -> bytes:
+    """Up to ``size`` bytes, fewer only at end of file."""
+    data = src.read(size)
+    while len(data) < size:
+        more = src.read(size - len(data))
+        if not more:
+            break
+        data += more
+    return data
+
+
+def _file_header(wrapped: str, chunk_size: int) -> tuple[bytes, bytes]:
+    if not 0 < chunk_size <= MAX_CHUNK_SIZE:
+        raise ValueError(f"Chunk size must be between 1 and {MAX_CHUNK_SIZE} bytes")
+    prefix = os.urandom(7)
+    wrapped_bytes = wrapped.encode()
+    header = FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION, chunk_size, prefix, len(wrapped_bytes))
+    return header + wrapped_bytes, prefix
+
+
+def _read_file_header(src: BinaryIO) -> tuple[bytes, int, bytes, str]:
+    fixed = _read_exactly(src, FILE_HEADER.size)
+    if len(fixed) < FILE_HEADER.size:
+        raise ValueError("Not an encrypted file")
+    magic, version, chunk_size, prefix, wrapped_length = FILE_HEADER.unpack(fixed)
+    if magic != FILE_MAGIC:
+        raise ValueError("Not an encrypted file")
+    if version != FILE_VERSION:
+        raise ValueError(f"Unsupported encrypted file version {version}")
+    if not 0 < chunk_size <= MAX_CHUNK_SIZE:
+        raise ValueError("Encrypted file header is corrupt")
+    wrapped = _read_exactly(src, wrapped_length)
+    if len(wrapped) < wrapped_length:
+        raise ValueError("Encrypted file is truncated")
+    return fixed + wrapped, chunk_size, prefix, wrapped.decode()
+
+
+def _read_chunk_length(src: BinaryIO) -> Optional[int]:
+    data = _read_exactly(src, CHUNK_LENGTH.size)
+    if not data:
+        return None
+    if len(data) < CHUNK_LENGTH.size:
+        raise ValueError("Encrypted file is truncated")
+    return CHUNK_LENGTH.unpack(data)[0]
+
+
+def _seal_stream(src: BinaryIO, dst: BinaryIO, aesgcm: AESGCM, header: bytes, prefix: bytes,
+                 tenant_id: str, chunk_size: int):
+    aad = header + tenant_id.encode()
+    dst.write(header)
+    chunk = _read_exactly(src, chunk_size)
+    counter = 0
+    while True:
+        # Read one chunk ahead to know whether this one is the last.
+        following = _read_exactly(src, chunk_size) if len(chunk) == chunk_size else b""
+        last = not following
+        sealed = aesgcm.encrypt(CHUNK_NONCE.pack(prefix, counter, last), chunk, aad)
+        dst.write(CHUNK_LENGTH.pack(len(sealed)))
+        dst.write(sealed)
+        if last:
+            return
+        chunk = following
+        counter += 1
+
+
+def _open_stream(src: BinaryIO, dst: BinaryIO, aesgcm: AESGCM, header: bytes, prefix: bytes,
+                 tenant_id: str, chunk_size: int):
+    aad = header + tenant_id.encode()
+    length = _read_chunk_length(src)
+    counter = 0
+    while length is not None:
+        if length > chunk_size + TAG_SIZE:
+            raise ValueError(f"Chunk {counter} of encrypted file is corrupt")
+        sealed = _read_exactly(src, length)
+        if len(sealed) < length:
+            raise ValueError("Encrypted file is truncated")
+        following = _read_chunk_length(src)
+        last = following is None
+        try:
+            dst.write(aesgcm.decrypt(CHUNK_NONCE.pack(prefix, counter, last), sealed, aad))
+        except InvalidTag:
+            raise ValueError(f"Chunk {counter} of encrypted file failed authentication")
+        if last:
+            return
+        length = following
+        counter += 1
+    raise ValueError("Encrypted file is truncated")
+
+
+class DataKey:
+    __slots__ = ("aesgcm", "wrapped", "expires_at", "uses")
+
+    def __init__(self, plaintext_key: bytes, wrapped: str, ttl: float):
+        self.aesgcm = AESGCM(plaintext_key)
+        self.wrapped = wrapped
+        self.expires_at = time.monotonic() + ttl
+        self.uses = 0
+
+
+class DataKeyCache:
+    """Unwrapped data-encryption keys, per (tenant, role).
+
+    For encryption each (tenant, role) has one current key, replaced after
+    ``ttl`` seconds or ``max_uses`` encryptions, whichever comes first.
+    For decryption, keys unwrapped from stored ciphertexts are kept in an
+    LRU of ``max_size`` entries for ``ttl`` seconds. Keys are cached per
+    role so a role without transit decrypt rights in Vault cannot reuse a
+    key another role unwrapped.
+    """
+
+    def __init__(self, ttl: float, max_uses: int, max_size: int):
+        self.ttl = ttl
+        self.max_uses = max_uses
+        self.max_size = max_size
+        self._current: dict[tuple[str, str], DataKey] = {}
+        self._unwrapped: "OrderedDict[tuple[str, str, str], DataKey]" = OrderedDict()
+        self._generating: dict[tuple[str, str], asyncio.Lock] = {}
+
+    def _usable(self, key) -> bool:
+        return key is not None and key.expires_at > time.monotonic() and key.uses < self.max_uses
+
+    async def current(self, tenant_id: str, role: str, generate) -> DataKey:
+        """The key to encrypt with; ``await generate()`` returns (plaintext key, wrapped key)."""
+        key = self._current.get((tenant_id, role))
+        if not self._usable(key):
+            # One Vault call per (tenant, role) when the key runs out,
+            # not one per request waiting on it.
+            async with self._generating.setdefault((tenant_id, role), asyncio.Lock()):
+                key = self._current.get((tenant_id, role))
+                if not self._usable(key):
+                    key = DataKey(*await generate(), ttl=self.ttl)
+                    self._current[(tenant_id, role)] = key
+                    self._remember(tenant_id, role, key)
+        key.uses += 1
+        return key
+
+    async def unwrapped(self, tenant_id: str, role: str, wrapped: str, unwrap) -> DataKey:
+        """The key for ``wrapped``; ``await unwrap()`` returns its plaintext on a miss."""
+        cache_key = (tenant_id, role, wrapped)
+        key = self._unwrapped.get(cache_key)
+        if key is not None and key.expires_at > time.monotonic():
+            self._unwrapped.move_to_end(cache_key)
+            return key
+        key = DataKey(await unwrap(), wrapped, ttl=self.ttl)
+        self._remember(tenant_id, role, key)
+        return key
+
+    def _remember(self, tenant_id: str, role: str, key: DataKey):
+        self._unwrapped[(tenant_id, role, key.wrapped)] = key
+        self._unwrapped.move_to_end((tenant_id, role, key.wrapped))
+        while len(self._unwrapped) > self.max_size:
+            self._unwrapped.popitem(last=False)
+
+    def clear(self):
+        self._current.clear()
+        self._unwrapped.clear()
+
+
+data_key_cache = DataKeyCache(
+    ttl=settings.ENVELOPE_DEK_TTL_SECONDS,
+    max_uses=settings.ENVELOPE_DEK_MAX_USES,
+    max_size=settings.ENVELOPE_DEK_CACHE_SIZE,
+)
 
 class EncryptionService:
-    def __init__(self):
+    def __init__(self, token_cache=vault_token_cache, data_keys=data_key_cache):
         self.vault_client = VaultClient()
+        self.token_cache = token_cache
+        self.data_keys = data_keys
 
-    def encrypt_data(self, tenant_id: str, role: str, plaintext: str):
+    async def _transit(self, tenant_id: str, role: str, operation: str, **params) -> dict:
+        """Call transit ``operation`` on the tenant's key with the cached (tenant, role) token.
+
+        A 403 usually means the cached token was revoked or replaced, so
+        it is read from Vault once more and the call retried.
+        """
+        vault = self.vault_client.vault
+        key_name = f"{tenant_id}-transit"
+        try:
+            token = await self.token_cache.get(tenant_id, role)
+            return await vault.transit(operation, key_name, token, **params)
+        except VaultForbidden:
+            self.token_cache.invalidate(tenant_id, role)
+            token = await self.token_cache.get(tenant_id, role)
+            return await vault.transit(operation, key_name, token, **params)
+
+    async def encrypt_data(self, tenant_id: str, role: str, plaintext: str):
         """Encrypt plaintext data using Vault's transit engine."""
         try:
-            token = self.vault_client.get_vault_token(tenant_id, role)
-            self.vault_client.client.token = token
-            response = self.vault_client.client.secrets.transit.encrypt_data(
-                name=f"{tenant_id}-transit",
+            response = await self._transit(
+                tenant_id, role, "encrypt",
                 plaintext=base64.b64encode(plaintext.encode()).decode()
             )
-            return response['data']['ciphertext']
+            return response['ciphertext']
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
 
-    def decrypt_data(self, tenant_id: str, role: str, ciphertext: str):
+    async def decrypt_data(self, tenant_id: str, role: str, ciphertext: str):
         """Decrypt encrypted data using Vault's transit engine."""
         try:
-            token = self.vault_client.get_vault_token(tenant_id, role)
-            self.vault_client.client.token = token
-            response = self.vault_client.client.secrets.transit.decrypt_data(
-                name=f"{tenant_id}-transit",
-                ciphertext=ciphertext
+            response = await self._transit(tenant_id, role, "decrypt", ciphertext=ciphertext)
+            return base64.b64decode(response['plaintext']).decode()
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+    async def _transit_batch(self, tenant_id: str, role: str, values: list, operation: str, item_key: str,
+                             result_key: str) -> list:
+        """Run a transit batch operation over ``values`` in request-sized chunks.
+
+        Results come back in input order; ``None`` values pass through
+        untouched so nullable columns can be batched as they are.
+        """
+        positions = [i for i, value in enumerate(values) if value is not None]
+        results = [None] * len(values)
+        size = settings.VAULT_TRANSIT_BATCH_SIZE
+        for start in range(0, len(positions), size):
+            chunk = positions[start:start + size]
+            batch_input = [{item_key: values[i]} for i in chunk]
+            response = await self._transit(tenant_id, role, operation, batch_input=batch_input)
+            for i, item in zip(chunk, response['batch_results']):
+                if item.get('error'):
+                    raise ValueError(f"Item {i}: {item['error']}")
+                results[i] = item[result_key]
+        return results
+
+    async def encrypt_batch(self, tenant_id: str, role: str, plaintexts: list) -> list:
+        """Encrypt many values with one transit call per VAULT_TRANSIT_BATCH_SIZE items."""
+        try:
+            return await self._transit_batch(
+                tenant_id, role,
+                [None if p is None else base64.b64encode(p.encode()).decode() for p in plaintexts],
+                "encrypt",
+                item_key='plaintext',
+                result_key='ciphertext',
             )
-            return base64.b64decode(response['data']['plaintext']).decode()
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
 
-    def encrypt_file(self, tenant_id: str, role: str, file_path: str):
-        """Encrypt a file's content using Vault."""
+    async def decrypt_batch(self, tenant_id: str, role: str, ciphertexts: list) -> list:
+        """Decrypt many values with one transit call per VAULT_TRANSIT_BATCH_SIZE items."""
         try:
-            with open(file_path, "rb") as f:
-                plaintext = f.read()
-            encrypted_text = self.encrypt_data(tenant_id, role, plaintext.decode())
-            return encrypted_text
+            encoded = await self._transit_batch(
+                tenant_id, role, ciphertexts,
+                "decrypt",
+                item_key='ciphertext',
+                result_key='plaintext',
+            )
+            return [None if p is None else base64.b64decode(p).decode() for p in encoded]
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
 
-    def decrypt_file(self, tenant_id: str, role: str, encrypted_text: str, output_path: str):
-        """Decrypt an encrypted file's content and save it."""
+    # Envelope mode: fields are encrypted locally with a data key from
+    # transit/datakey; Vault is only called to mint or unwrap a key.
+
+    async def _generate_data_key(self, tenant_id: str, role: str) -> tuple[bytes, str]:
+        response = await self._transit(tenant_id, role, "datakey/plaintext")
+        return base64.b64decode(response['plaintext']), response['ciphertext']
+
+    async def _unwrap_data_key(self, tenant_id: str, role: str, wrapped: str) -> bytes:
+        response = await self._transit(tenant_id, role, "decrypt", ciphertext=wrapped)
+        return base64.b64decode(response['plaintext'])
+
+    async def envelope_encrypt(self, tenant_id: str, role: str, plaintext: str) -> str:
+        """Encrypt locally with AES-GCM; the wrapped data key is stored in the result."""
+        try:
+            key = await self.data_keys.current(
+                tenant_id, role, lambda: self._generate_data_key(tenant_id, role)
+            )
+            nonce = os.urandom(NONCE_SIZE)
+            # The tenant is authenticated data, so a value cannot be moved
+            # to another tenant's rows and still decrypt.
+            sealed = key.aesgcm.encrypt(nonce, plaintext.encode(), tenant_id.encode())
+            return f"{ENVELOPE_PREFIX}{_b64e(key.wrapped.encode())}:{_b64e(nonce + sealed)}"
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+    async def envelope_decrypt(self, tenant_id: str, role: str, ciphertext: str) -> str:
+        """Decrypt a value from envelope_encrypt, unwrapping its data key on a cache miss."""
+        try:
+            if not ciphertext.startswith(ENVELOPE_PREFIX):
+                raise ValueError("Not an envelope ciphertext")
+            wrapped_part, _, sealed_part = ciphertext[len(ENVELOPE_PREFIX):].partition(":")
+            wrapped = _b64d(wrapped_part).decode()
+            sealed = _b64d(sealed_part)
+            key = await self.data_keys.unwrapped(
+                tenant_id, role, wrapped, lambda: self._unwrap_data_key(tenant_id, role, wrapped)
+            )
+            return key.aesgcm.decrypt(sealed[:NONCE_SIZE], sealed[NONCE_SIZE:], tenant_id.encode()).decode()
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+    # Files: streamed in FILE_ENCRYPTION_CHUNK_SIZE chunks under a fresh
+    # data key per file, so memory use does not grow with the file.
+
+    async def encrypt_stream(self, tenant_id: str, role: str, src: BinaryIO, dst: BinaryIO):
+        """Encrypt binary file object ``src`` into ``dst`` in the chunked file format."""
+        plaintext_key, wrapped = await self._generate_data_key(tenant_id, role)
+        header, prefix = _file_header(wrapped, settings.FILE_ENCRYPTION_CHUNK_SIZE)
+        await asyncio.to_thread(_seal_stream, src, dst, AESGCM(plaintext_key), header, prefix,
+                                tenant_id, settings.FILE_ENCRYPTION_CHUNK_SIZE)
+
+    async def decrypt_stream(self, tenant_id: str, role: str, src: BinaryIO, dst: BinaryIO):
+        """Decrypt ``src``, written by encrypt_stream, into ``dst``.
+
+        Each chunk is authenticated before it is written; a tampered,
+        reordered or truncated file raises ValueError partway through.
+        """
+        header, chunk_size, prefix, wrapped = await asyncio.to_thread(_read_file_header, src)
+        plaintext_key = await self._unwrap_data_key(tenant_id, role, wrapped)
+        await asyncio.to_thread(_open_stream, src, dst, AESGCM(plaintext_key), header, prefix,
+                                tenant_id, chunk_size)
+
+    async def encrypt_file(self, tenant_id: str, role: str, input_path: str, output_path: str):
+        """Encrypt the file at ``input_path`` into ``output_path``.
+
+        Like decrypt_file, writes a ".part" file first, so ``output_path``
+        never holds a partly encrypted file.
+        """
+        partial_path = f"{output_path}.part"
+        try:
+            with open(input_path, "rb") as src, open(partial_path, "wb") as dst:
+                await self.encrypt_stream(tenant_id, role, src, dst)
+            os.replace(partial_path, output_path)
+        except Exception as e:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            raise HTTPException(status_code=500, detail=str(e))
+
+    async def decrypt_file(self, tenant_id: str, role: str, input_path: str, output_path: str):
+        """Decrypt the file at ``input_path`` into ``output_path``.
+
+        Plaintext goes to a ".part" file that only replaces ``output_path``
+        once the whole file has been authenticated.
+        """
+        partial_path = f"{output_path}.part"
         try:
-            decrypted_text = self.decrypt_data(tenant_id, role, encrypted_text)
-            with open(output_path, "wb") as f:
-                f.write(decrypted_text.encode())
+            with open(input_path, "rb") as src, open(partial_path, "wb") as dst:
+                await self.decrypt_stream(tenant_id, role, src, dst)
+            os.replace(partial_path, output_path)
         except Exception as e:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
             raise HTTPException(status_code=500, detail=str(e))
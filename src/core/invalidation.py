@@ -0,0 +1,211 @@
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool
+from .database import engine, tenant_schema
+from .config import settings
+from .models.public import (Tenant, Plan, Language, ComplianceImplemented, TenantTestimonials,
+                            FAQQuestion, FAQAnswer, FAQComment, FAQLike)
+from .models.tenant import Role, Department
+from typing import Callable, Optional
+import asyncio
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "cache_invalidation"
+
+# Public rows are keyed by id; tenant rows by "<schema>:<id>" since ids repeat
+# across tenant schemas.
+PUBLIC_MODELS = {
+    Tenant: "tenant",
+    Plan: "plan",
+    # Landing page content is cached as a whole, so one namespace covers it
+    Language: "landing",
+    ComplianceImplemented: "landing",
+    TenantTestimonials: "landing",
+    FAQQuestion: "landing",
+    FAQAnswer: "landing",
+    FAQComment: "landing",
+    FAQLike: "landing",
+}
+TENANT_MODELS = {Role: "role", Department: "department"}
+
+
+def listen_engine():
+    """Engine for the LISTEN connection, or None if LISTEN is unavailable.
+
+    LISTEN is session state, which PgBouncer in transaction mode does not
+    keep, so that setup needs DATABASE_DIRECT_URL pointing at Postgres.
+    """
+    if not settings.DB_PGBOUNCER:
+        return engine
+    if settings.DATABASE_DIRECT_URL:
+        return create_async_engine(str(settings.DATABASE_DIRECT_URL), poolclass=NullPool)
+    return None
+
+
+def scoped_key(schema: str, object_id) -> str:
+    return f"{schema}:{object_id}"
+
+
+def split_scoped_key(key: str) -> tuple[str, str]:
+    schema, _, object_id = key.partition(":")
+    return schema, object_id
+
+
+class InvalidationBus:
+    """Cross-worker cache invalidation over Postgres LISTEN/NOTIFY.
+
+    Handlers are registered per namespace and called with the invalidated
+    key, or with ``None`` when every entry in the namespace must go (e.g.
+    after the listener reconnects and notifications may have been missed).
+
+    A half-open LISTEN connection (a NAT or PgBouncer idle drop, a silent
+    failover) never reports termination, so every ``check_interval``
+    seconds the connection must answer ``SELECT 1`` within
+    ``check_timeout``; if it does not, caches are flushed and the
+    listener reconnects.
+    """
+
+    def __init__(self, channel: str = CHANNEL, reconnect_delay: float = 1.0,
+                 check_interval: float = 30.0, check_timeout: float = 5.0):
+        self.channel = channel
+        self.reconnect_delay = reconnect_delay
+        self.check_interval = check_interval
+        self.check_timeout = check_timeout
+        self._handlers: dict[str, list[Callable[[Optional[str]], None]]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._listen_on = None
+        self.received = 0
+
+    def subscribe(self, namespace: str, handler: Callable[[Optional[str]], None]):
+        self._handlers.setdefault(namespace, []).append(handler)
+
+    def dispatch(self, namespace: str, key: Optional[str]):
+        for handler in self._handlers.get(namespace, ()):
+            try:
+                handler(key)
+            except Exception as e:
+                logger.error(f"Invalidation handler for {namespace!r} failed: {e}", exc_info=True)
+
+    def dispatch_all(self):
+        for namespace in list(self._handlers):
+            self.dispatch(namespace, None)
+
+    async def start(self):
+        if self._task is not None:
+            return
+        listen_on = listen_engine()
+        if listen_on is None:
+            logger.warning("DB_PGBOUNCER is set without DATABASE_DIRECT_URL; "
+                           "cross-worker cache invalidation is disabled")
+            return
+        self._listen_on = listen_on
+        self._task = asyncio.create_task(self._listen_forever(listen_on))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._listen_on is not None and self._listen_on is not engine:
+            # The DATABASE_DIRECT_URL engine belongs to the bus.
+            await self._listen_on.dispose()
+        self._listen_on = None
+
+    async def _listen_forever(self, listen_on):
+        while True:
+            lost = asyncio.Event()
+            try:
+                async with listen_on.connect() as conn:
+                    raw = await conn.get_raw_connection()
+                    driver_conn = raw.driver_connection
+                    await driver_conn.add_listener(self.channel, self._on_notify)
+                    driver_conn.add_termination_listener(lambda _: lost.set())
+                    logger.info(f"Listening for cache invalidations on {self.channel!r}")
+                    # Anything cached before (re)connecting may have missed a message.
+                    self.dispatch_all()
+                    await self._watch(driver_conn, lost)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Invalidation listener error: {e}")
+            # Messages may be lost until the listener is back; drop what they cover.
+            self.dispatch_all()
+            logger.warning("Invalidation listener disconnected, reconnecting")
+            await asyncio.sleep(self.reconnect_delay)
+
+    async def _watch(self, driver_conn, lost: asyncio.Event):
+        """Return once the connection is lost or stops answering."""
+        while True:
+            try:
+                await asyncio.wait_for(lost.wait(), self.check_interval)
+                return
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await asyncio.wait_for(driver_conn.fetchval("SELECT 1"), self.check_timeout)
+            except Exception as e:
+                logger.warning(f"Invalidation listener failed its liveness check: {e!r}")
+                # Closing gracefully would wait on the dead socket.
+                driver_conn.terminate()
+                return
+
+    def _on_notify(self, connection, pid, channel, payload):
+        try:
+            message = json.loads(payload)
+            namespace, key = message["ns"], message.get("key")
+        except (ValueError, KeyError, TypeError):
+            logger.warning(f"Ignoring malformed invalidation payload: {payload!r}")
+            return
+        self.received += 1
+        self.dispatch(namespace, key)
+
+
+invalidation_bus = InvalidationBus(
+    check_interval=settings.INVALIDATION_CHECK_INTERVAL_SECONDS,
+    check_timeout=settings.INVALIDATION_CHECK_TIMEOUT_SECONDS,
+)
+
+
+# --------------------------
+# Publishing from ORM writes
+# --------------------------
+# Keys are published with pg_notify inside the writing transaction, so
+# Postgres only delivers them (to every worker, this one included) once the
+# transaction commits, and drops them on rollback.
+
+def _invalidation_key(obj) -> Optional[tuple[str, str]]:
+    namespace = PUBLIC_MODELS.get(type(obj))
+    if namespace is not None:
+        return namespace, str(obj.id)
+    namespace = TENANT_MODELS.get(type(obj))
+    if namespace is not None:
+        return namespace, scoped_key(tenant_schema.get(), obj.id)
+    return None
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_invalidations(session, flush_context):
+    pending = session.info.setdefault("pending_invalidations", set())
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        key = _invalidation_key(obj)
+        if key is not None:
+            pending.add(key)
+
+
+@event.listens_for(Session, "after_flush_postexec")
+def _publish_invalidations(session, flush_context):
+    pending = session.info.pop("pending_invalidations", None)
+    if not pending:
+        return
+    payloads = [json.dumps({"ns": namespace, "key": key}) for namespace, key in sorted(pending)]
+    session.connection().execute(
+        text("SELECT pg_notify(:channel, payload) FROM unnest(CAST(:payloads AS text[])) AS payload"),
+        {"channel": CHANNEL, "payloads": payloads},
+    )
@@ -1,14 +1,16 @@
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.requests import Request
-from starlette.responses import Response
-from fastapi import HTTPException
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
 from contextvars import ContextVar
-from sqlalchemy import select, text
-from sqlalchemy.ext.asyncio import AsyncSession
-from .database import AsyncSessionLocal, tenant_schema
+from sqlalchemy import select
+from .database import (AsyncSessionLocal, READ_YOUR_WRITES_COOKIE, ReadYourWrites,
+                       db_read_only, db_read_your_writes, tenant_schema)
 from .models.public import Tenant
+from .query_stats import request_scope
+from .tenant_cache import (tenant_cache, negative_tenant_cache, known_hosts,
+                           subdomain_key, custom_domain_key)
 from .config import settings
-import re
+from http.cookies import CookieError, SimpleCookie
 import logging
 
 # Set up logging
@@ -17,41 +19,109 @@ logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 tenant_context = ContextVar("tenant_context", default=None)
 
-class TenantMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        host = request.headers.get("host", "").split(":")[0]
-        main_domain = settings.MAIN_DOMAIN
-        request.state.is_public = False
-        tenant = None
-
-        if host in [main_domain, "localhost"]:
-            request.state.is_public = True
-        else:
-            async with AsyncSessionLocal() as session:
-                if host.endswith(f".{main_domain}"):
-                    subdomain = host.replace(f".{main_domain}", "").split('.')[0]
-                    print("hi",subdomain)
-                    result = await session.execute(
-                        select(Tenant).filter_by(subdomain=subdomain, is_active=True)
-                    )
-                else:
-                    result = await session.execute(
-                        select(Tenant).filter_by(custom_domain=host, is_active=True)
-                    )
-                tenant = result.scalars().first()
-
-                if not tenant:
-                    raise HTTPException(status_code=404, detail="Tenant not found")
-
-                request.state.tenant = tenant
-                tenant_schema.set(f"tenant_{tenant.id}")
-                print(f"Middleware set tenant_schema to: {tenant_schema.get()}")  # Debugging print
-
-                tenant_context.set(tenant.id)
-
-        # async with AsyncSessionLocal() as test_session:
-        #     result = await test_session.execute(text("SHOW search_path"))
-        #     logger.debug(f"IMMEDIATE TEST search_path: {(await result.fetchone())[0]}")
-
-        response = await call_next(request)
-        return response
\ No newline at end of file
+# Requests with these methods may read from a replica
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+def is_public_host(host: str) -> bool:
+    return host in [settings.MAIN_DOMAIN, "localhost"]
+
+
+async def resolve_tenant(host: str):
+    """Return the active tenant serving ``host``, or None if there is none."""
+    main_domain = settings.MAIN_DOMAIN
+    if host.endswith(f".{main_domain}"):
+        subdomain = host.replace(f".{main_domain}", "").split('.')[0]
+        cache_key = subdomain_key(subdomain)
+        query = select(Tenant).filter_by(subdomain=subdomain, is_active=True)
+    else:
+        cache_key = custom_domain_key(host)
+        query = select(Tenant).filter_by(custom_domain=host, is_active=True)
+
+    tenant = tenant_cache.get(cache_key)
+    if tenant is not None:
+        return tenant
+
+    # Junk hosts (scanners, stale DNS) are rejected without a pool checkout.
+    if cache_key in negative_tenant_cache:
+        return None
+    await known_hosts.refresh_if_stale()
+    if not known_hosts.may_contain(cache_key):
+        negative_tenant_cache.add(cache_key)
+        return None
+
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(query)
+        tenant = result.scalars().first()
+    if not tenant:
+        negative_tenant_cache.add(cache_key)
+        return None
+    return tenant_cache.set(cache_key, tenant)
+
+
+class TenantMiddleware:
+    """Pure ASGI middleware that binds the tenant for the request's Host.
+
+    Populates ``request.state.is_public`` / ``request.state.tenant`` through
+    ``scope["state"]`` and sets the ``tenant_schema`` and ``tenant_context``
+    context vars for the downstream app, resetting them when it returns.
+    Also carries the client's read-your-writes window in and out through
+    READ_YOUR_WRITES_COOKIE.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        host = headers.get("host", "").split(":")[0]
+        state = scope.setdefault("state", {})
+        state["is_public"] = False
+        db_read_only.set(scope["method"] in SAFE_METHODS)
+        request_scope.set(scope)
+        send = self._read_your_writes(headers, send)
+
+        if is_public_host(host):
+            state["is_public"] = True
+            await self.app(scope, receive, send)
+            return
+
+        tenant = await resolve_tenant(host)
+        if not tenant:
+            response = JSONResponse({"detail": "Tenant not found"}, status_code=404)
+            await response(scope, receive, send)
+            return
+
+        state["tenant"] = tenant
+        schema_token = tenant_schema.set(f"tenant_{tenant.id}")
+        context_token = tenant_context.set(tenant.id)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            tenant_context.reset(context_token)
+            tenant_schema.reset(schema_token)
+
+    @staticmethod
+    def _read_your_writes(headers: Headers, send: Send) -> Send:
+        """Bind the client's read-your-writes state; renew its cookie if the request writes."""
+        cookie = SimpleCookie()
+        try:
+            cookie.load(headers.get("cookie", ""))
+        except CookieError:
+            pass
+        morsel = cookie.get(READ_YOUR_WRITES_COOKIE)
+        read_your_writes = ReadYourWrites.from_cookie(morsel.value if morsel else None)
+        db_read_your_writes.set(read_your_writes)
+
+        async def send_with_cookie(message):
+            if message["type"] == "http.response.start" and read_your_writes.wrote:
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"set-cookie", read_your_writes.cookie().encode("latin-1"))
+                ]
+            await send(message)
+
+        return send_with_cookie
@@ -3,6 +3,7 @@ from sqlalchemy.orm import relationship, validates
 from sqlalchemy.sql import func
 from core.database import TenantAwareBase, tenant_schema
 from core.models.public import Tenant
+from core.encrypted_column import EncryptedString
 
 # --------------------------
 # Role-Based Access Control
@@ -108,7 +109,8 @@ class Provider(TenantAwareBase):
     fee = Column(Integer)
     currency = Column(String(30))
     # Professional Details
-    license_number = Column(String(100))  # Encrypted
+    # Room for the ciphertext of 100 characters of any script (up to 400 UTF-8 bytes)
+    license_number = Column(EncryptedString(1024))
     specialty = Column(String(100))
     qualifications = Column(JSON)  # [{"degree": "MD", "year": 2010}]
     availability = Column(JSON)  # Recurring schedule
@@ -136,7 +138,9 @@ class Patient(TenantAwareBase):
     phone_number = Column(String(20))
     date_of_birth = Column(DateTime)
     gender = Column(String(20))
-    encrypted_ssn = Column(String(200))
+    # Room for the ciphertext of 200 characters of any script (up to 800 UTF-8 bytes)
+    encrypted_ssn = Column(EncryptedString(1200, blind_index="ssn_index"))
+    ssn_index = Column(String(64), index=True)
     insurance_provider = Column(String(100))
     policy_number = Column(String(100))
     
@@ -360,4 +364,18 @@ class InventoryItem(TenantAwareBase):
     description = Column(Text)
     quantity = Column(Integer)
     supplier = Column(String(100))
-    last_restocked = Column(DateTime)
\ No newline at end of file
+    last_restocked = Column(DateTime)
+
+# --------------------------
+# Key rotation
+# --------------------------
+class RewrapCheckpoint(TenantAwareBase):
+    """Progress of re-encrypting one column under the latest transit key (core.rewrap)."""
+    __tablename__ = "rewrap_checkpoints"
+    table_name = Column(String(100), primary_key=True)
+    column_name = Column(String(100), primary_key=True)
+    key_version = Column(Integer, nullable=False)  # version being rewrapped to
+    last_id = Column(Integer, nullable=False, default=0)  # keyset position
+    rows_rewrapped = Column(Integer, nullable=False, default=0)
+    completed_at = Column(DateTime)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
@@ -0,0 +1,61 @@
+# Every permission the application checks. The position is the bit a
+# permission occupies in a compiled role, so only append to this list.
+PERMISSIONS = (
+    "admin",
+    "medical.access",
+    "appointment.create",
+    "appointment.edit_any",
+    "appointment.cancel_late",
+    "appointment.view_notes",
+    "appointment.view_participants",
+    "schedule.view_availability",
+    "patient.delete",
+)
+PERMISSION_BITS = {name: 1 << i for i, name in enumerate(PERMISSIONS)}
+
+# What the built-in roles are granted. A role's JSON ``permissions`` can
+# grant or revoke any permission above on top of this, which is how
+# custom roles get theirs.
+ROLE_DEFAULTS = {
+    "clinic_admin": {
+        "admin",
+        "appointment.create",
+        "appointment.edit_any",
+        "appointment.cancel_late",
+        "appointment.view_notes",
+        "appointment.view_participants",
+        "schedule.view_availability",
+        "patient.delete",
+    },
+    "staff": {
+        "appointment.create",
+        "appointment.edit_any",
+        "appointment.view_notes",
+        "schedule.view_availability",
+    },
+    "doctor": {"medical.access"},
+    "nurse": {"medical.access"},
+    "admin": {"medical.access"},
+}
+
+
+def compile_permissions(role_name: str, overrides) -> int:
+    """Bitset of the permissions held by a role."""
+    bits = 0
+    for name in ROLE_DEFAULTS.get(role_name, ()):
+        bits |= PERMISSION_BITS[name]
+    for name, granted in (overrides or {}).items():
+        bit = PERMISSION_BITS.get(name)
+        if bit is None:
+            # Legacy keys such as "ehr_write" are not enforced anywhere.
+            continue
+        bits = bits | bit if granted else bits & ~bit
+    return bits
+
+
+def permission_bit(name: str) -> int:
+    try:
+        return PERMISSION_BITS[name]
+    except KeyError:
+        raise ValueError(f"Unknown permission: {name}")
+
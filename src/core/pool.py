@@ -0,0 +1,132 @@
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from contextvars import ContextVar
+from .metrics import metrics, Histogram
+from typing import Optional
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Checkout waits in milliseconds; anything near the top bucket means the
+# pool is exhausted and requests are queueing for DB_POOL_TIMEOUT.
+CHECKOUT_WAIT_BUCKETS = (0.05, 0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000, 5000, 30000)
+
+# True while PoolProber is checking connections out. Pool and query metrics
+# leave those checkouts out, so they only describe application traffic.
+pool_probing: ContextVar[bool] = ContextVar("pool_probing", default=False)
+
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """AsyncAdaptedQueuePool that times how long each checkout waits.
+
+    The time covers waiting for an idle connection and, when the pool has
+    to grow into overflow, opening the new one.
+    """
+
+    checkout_wait: Optional[Histogram] = None
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            if self.checkout_wait is not None and not pool_probing.get():
+                self.checkout_wait.observe((time.perf_counter() - started) * 1000)
+
+    def recreate(self):
+        # engine.dispose() swaps in a recreated pool; keep reporting into
+        # the same histogram.
+        pool = super().recreate()
+        pool.checkout_wait = self.checkout_wait
+        return pool
+
+
+def pool_stats(target_engine) -> dict:
+    pool = target_engine.pool
+    if not isinstance(pool, AsyncAdaptedQueuePool):
+        # NullPool behind PgBouncer: nothing is held here.
+        return {"pool": type(pool).__name__}
+    return {
+        "pool": type(pool).__name__,
+        "size": pool.size(),
+        "max_overflow": pool._max_overflow,
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": max(pool.overflow(), 0),
+        "checkout_wait_ms": pool.checkout_wait.snapshot() if getattr(pool, "checkout_wait", None) else None,
+    }
+
+
+class PoolProber:
+    """Background health check of idle pooled connections.
+
+    Every ``interval`` seconds each watched pool gets as many ``SELECT 1``
+    round trips as it has idle connections. Checkouts are FIFO, so this
+    walks the idle connections in turn. A failed ping on a dropped
+    connection makes SQLAlchemy invalidate the pool, so every connection
+    opened before the failure is replaced on its next checkout instead of
+    failing a request. This complements pool_pre_ping rather than
+    replacing it: a connection can still die between probes.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._engines: dict[str, object] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.last_probe: dict[str, Optional[float]] = {}
+        self.last_error: dict[str, Optional[str]] = {}
+
+    def watch(self, target_engine, name: str):
+        self._engines[name] = target_engine
+        self.last_probe[name] = None
+        self.last_error[name] = None
+
+    async def probe(self, name: str):
+        target_engine = self._engines[name]
+        pool = target_engine.pool
+        if not isinstance(pool, AsyncAdaptedQueuePool):
+            return
+        for _ in range(pool.checkedin()):
+            try:
+                async with target_engine.connect() as conn:
+                    await conn.exec_driver_sql("SELECT 1")
+            except Exception as e:
+                metrics.counter(f"db.pool.{name}.probe_failures").inc()
+                if self.last_error[name] is None:
+                    logger.warning(f"Pool {name} health probe failed: {e}")
+                self.last_error[name] = str(e)
+                return
+        metrics.counter(f"db.pool.{name}.probes").inc()
+        self.last_probe[name] = time.time()
+        self.last_error[name] = None
+
+    async def _run(self):
+        pool_probing.set(True)
+        while True:
+            await asyncio.sleep(self.interval)
+            for name in list(self._engines):
+                await self.probe(name)
+
+    async def start(self):
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            name: {
+                **pool_stats(target_engine),
+                "last_probe": self.last_probe[name],
+                "last_error": self.last_error[name],
+            }
+            for name, target_engine in self._engines.items()
+        }
@@ -0,0 +1,148 @@
+from sqlalchemy import select
+from .database import tenant_schema
+from .invalidation import invalidation_bus, split_scoped_key
+from .config import settings
+from .models.tenant import Role
+from .permissions import compile_permissions, permission_bit
+from typing import Optional
+import hashlib
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def permission_version(role, schema: str) -> str:
+    """Digest of what a role grants in ``schema``; changes whenever its name or permissions do.
+
+    The schema is part of the digest because every tenant is seeded with
+    the same default roles: without it a version would match across tenants.
+    """
+    material = json.dumps([schema, role.id, role.name, role.permissions], sort_keys=True, default=str)
+    return hashlib.sha256(material.encode()).hexdigest()[:16]
+
+
+def principal_claims(user, role) -> dict:
+    """JWT claims identifying ``user`` and pinning the version of its role."""
+    return {
+        "sub": str(user.id),
+        "tenant_id": str(user.tenant_id) if user.tenant_id else "public",
+        "role_id": role.id,
+        "role": role.name,
+        "pv": permission_version(role, tenant_schema.get()),
+    }
+
+
+class RoleSnapshot:
+    """Read-only copy of a Role row, safe to share between requests."""
+
+    __slots__ = ("id", "name", "permissions", "version", "permission_bits")
+
+    def __init__(self, role, schema: str):
+        object.__setattr__(self, "id", role.id)
+        object.__setattr__(self, "name", role.name)
+        object.__setattr__(self, "permissions", role.permissions)
+        object.__setattr__(self, "version", permission_version(role, schema))
+        object.__setattr__(self, "permission_bits", compile_permissions(role.name, role.permissions))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("RoleSnapshot is read-only")
+
+    def has(self, permission: str) -> bool:
+        return bool(self.permission_bits & permission_bit(permission))
+
+
+class Principal:
+    """The authenticated caller, built from token claims.
+
+    Stands in for the User row in authorization checks: ``id``,
+    ``tenant_id``, ``role_id`` and ``role.name`` behave as on User, and
+    ``has()`` tests a compiled permission (see core.permissions).
+    Endpoints that need other columns load the row themselves.
+    """
+
+    __slots__ = ("id", "tenant_id", "role_id", "role")
+
+    def __init__(self, user_id: int, tenant_id: Optional[int], role: RoleSnapshot):
+        self.id = user_id
+        self.tenant_id = tenant_id
+        self.role_id = role.id
+        self.role = role
+
+    def has(self, permission: str) -> bool:
+        return self.role.has(permission)
+
+    def __repr__(self):
+        return f"Principal(id={self.id}, tenant_id={self.tenant_id}, role={self.role.name!r})"
+
+
+class RoleRegistry:
+    """Compiled roles per tenant schema.
+
+    A tenant's roles are loaded together in one query and kept for ``ttl``
+    seconds. Any role change reported on the invalidation bus drops that
+    tenant's roles, on every worker.
+    """
+
+    def __init__(self, ttl: float, max_tenants: int):
+        self.ttl = ttl
+        self.max_tenants = max_tenants
+        self._tenants: dict[str, tuple[dict[int, RoleSnapshot], float, float]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, role_id) -> Optional[RoleSnapshot]:
+        entry = self._tenants.get(tenant_schema.get())
+        if entry is None or entry[1] < time.monotonic():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[0].get(role_id)
+
+    async def load(self, db) -> dict[int, RoleSnapshot]:
+        """(Re)load the current tenant's roles through ``db``."""
+        roles = (await db.execute(select(Role))).scalars().all()
+        schema = tenant_schema.get()
+        compiled = {role.id: RoleSnapshot(role, schema) for role in roles}
+        now = time.monotonic()
+        if len(self._tenants) >= self.max_tenants:
+            for schema in [k for k, (_, expires, _) in self._tenants.items() if expires < now]:
+                del self._tenants[schema]
+            if len(self._tenants) >= self.max_tenants:
+                self._tenants.clear()
+        self._tenants[schema] = (compiled, now + self.ttl, time.time())
+        return compiled
+
+    async def resolve(self, db, role_id, version: Optional[str] = None,
+                      issued_at: float = float("inf")) -> Optional[RoleSnapshot]:
+        """Role ``role_id``, reloading the tenant if it is missing or not at ``version``.
+
+        A role at another version is only reloaded if it was loaded before
+        ``issued_at`` (the token's iat): otherwise the token predates the
+        loaded roles and the role is returned as loaded.
+        """
+        role = self.get(role_id)
+        if role is not None and version is not None and role.version != version:
+            if self._tenants[tenant_schema.get()][2] < issued_at:
+                role = None
+        if role is None:
+            role = (await self.load(db)).get(role_id)
+        return role
+
+    def invalidate(self, key: Optional[str]):
+        if key is None:
+            self._tenants.clear()
+        else:
+            schema, _ = split_scoped_key(key)
+            self._tenants.pop(schema, None)
+
+    def stats(self) -> dict:
+        return {"tenants": len(self._tenants), "hits": self.hits, "misses": self.misses}
+
+
+role_registry = RoleRegistry(
+    ttl=settings.ROLE_REGISTRY_TTL_SECONDS,
+    max_tenants=settings.ROLE_REGISTRY_MAX_TENANTS,
+)
+invalidation_bus.subscribe("role", role_registry.invalidate)
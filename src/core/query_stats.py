@@ -0,0 +1,198 @@
+from contextvars import ContextVar
+from sqlalchemy import event
+from .database import engine, replicas, tenant_schema
+from .pool import pool_probing
+from .config import settings
+from typing import Optional
+import asyncio
+import logging
+import random
+import re
+import time
+
+logger = logging.getLogger(__name__)
+slow_query_logger = logging.getLogger("core.slow_query")
+
+# The ASGI scope of the request being served. Routing fills in
+# scope["route"] in place, so the matched path template is visible here
+# even though the middleware sets this before routing happens.
+request_scope: ContextVar[Optional[dict]] = ContextVar("request_scope", default=None)
+
+OTHER_ROUTES = "<other>"
+
+# SELECTs that do more than read: running them again under EXPLAIN ANALYZE
+# would lock rows, send notifications, advance sequences and the like. Such
+# statements are explained without ANALYZE, which plans but does not run them.
+SIDE_EFFECTS = re.compile(
+    r"\bFOR\s+(NO\s+KEY\s+UPDATE|UPDATE|SHARE|KEY\s+SHARE)\b|\bINTO\b"
+    r"|\b(pg_notify|nextval|setval|pg_advisory\w*|pg_try_advisory\w*|set_config|"
+    r"pg_cancel_backend|pg_terminate_backend|lo_\w+|dblink\w*)\s*\(",
+    re.IGNORECASE,
+)
+
+
+def replay_safe(statement: str) -> bool:
+    """Whether ``statement`` is a plain SELECT that can safely be run a second time."""
+    return statement.lstrip().upper().startswith("SELECT") and not SIDE_EFFECTS.search(statement)
+
+
+def current_route() -> str:
+    scope = request_scope.get()
+    if scope is None:
+        return "<background>"
+    route = scope.get("route")
+    path = getattr(route, "path", None) or scope.get("path", "")
+    return f"{scope.get('method', '')} {path}"
+
+
+class RouteStats:
+    __slots__ = ("count", "total_ms", "max_ms", "rows", "slow")
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.rows = 0
+        self.slow = 0
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "total_ms": round(self.total_ms, 3),
+            "mean_ms": round(self.total_ms / self.count, 3) if self.count else 0.0,
+            "max_ms": round(self.max_ms, 3),
+            "rows": self.rows,
+            "slow": self.slow,
+        }
+
+
+class QueryStats:
+    """Per-route statement timing aggregates, plus the slow-query log."""
+
+    def __init__(self, slow_threshold_ms: float, explain_sample_rate: float, max_routes: int):
+        self.slow_threshold_ms = slow_threshold_ms
+        self.explain_sample_rate = explain_sample_rate
+        self.max_routes = max_routes
+        self._routes: dict[str, RouteStats] = {}
+
+    def record(self, route: str, elapsed_ms: float, rows: Optional[int], slow: bool):
+        stats = self._routes.get(route)
+        if stats is None:
+            if len(self._routes) >= self.max_routes:
+                route = OTHER_ROUTES
+            stats = self._routes.setdefault(route, RouteStats())
+        stats.count += 1
+        stats.total_ms += elapsed_ms
+        stats.max_ms = max(stats.max_ms, elapsed_ms)
+        stats.rows += rows or 0
+        if slow:
+            stats.slow += 1
+
+    def snapshot(self) -> dict:
+        ordered = sorted(self._routes.items(), key=lambda item: item[1].total_ms, reverse=True)
+        return {route: stats.snapshot() for route, stats in ordered}
+
+    def reset(self):
+        self._routes.clear()
+
+
+query_stats = QueryStats(
+    slow_threshold_ms=settings.SLOW_QUERY_THRESHOLD_MS,
+    explain_sample_rate=settings.SLOW_QUERY_EXPLAIN_SAMPLE_RATE,
+    max_routes=settings.QUERY_STATS_MAX_ROUTES,
+)
+
+
+def _row_count(cursor) -> Optional[int]:
+    if cursor.rowcount is not None and cursor.rowcount >= 0:
+        return cursor.rowcount
+    # asyncpg's adapted cursor reports -1 for SELECT but has already
+    # buffered the result rows.
+    rows = getattr(cursor, "_rows", None)
+    return len(rows) if rows is not None else None
+
+
+# Sampled EXPLAINs running in the background; more are skipped, not queued.
+MAX_CONCURRENT_EXPLAINS = 2
+_explains: set[asyncio.Task] = set()
+
+
+async def _explain(target_engine, schema: str, statement: str, parameters, analyze: bool, label: str):
+    """EXPLAIN a slow statement on a connection of its own and log the plan.
+
+    Runs off the request path, so the request neither waits for the plan
+    nor has its transaction aborted when EXPLAIN fails. The transaction is
+    always rolled back, and statement_timeout bounds the second run that
+    ANALYZE makes.
+    """
+    options = "ANALYZE, BUFFERS, FORMAT JSON" if analyze else "FORMAT JSON"
+    try:
+        async with target_engine.connect() as conn:
+            conn.info["explaining"] = True
+            async with conn.begin() as transaction:
+                # Text statements are not schema-translated; unqualified
+                # tenant tables resolve through search_path.
+                await conn.exec_driver_sql(f"SET LOCAL search_path TO {schema}")
+                await conn.exec_driver_sql(
+                    f"SET LOCAL statement_timeout = {int(settings.SLOW_QUERY_EXPLAIN_TIMEOUT_MS)}"
+                )
+                result = await conn.exec_driver_sql(f"EXPLAIN ({options}) {statement}", parameters)
+                plan = result.scalar()
+                await transaction.rollback()
+        slow_query_logger.warning(f"Plan of slow query {label}\nplan={plan}")
+    except Exception as e:
+        logger.warning(f"Could not EXPLAIN slow query: {e}")
+
+
+def _explain_soon(target_engine, statement: str, parameters, analyze: bool, label: str):
+    if len(_explains) >= MAX_CONCURRENT_EXPLAINS:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return  # synchronous use, e.g. a script; nothing to run it on
+    task = loop.create_task(
+        _explain(target_engine, tenant_schema.get(), statement, parameters, analyze, label)
+    )
+    _explains.add(task)
+    task.add_done_callback(_explains.discard)
+
+
+def instrument_engine(target_engine):
+    sync_engine = target_engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (time.perf_counter() - conn.info["query_start_time"].pop()) * 1000
+        if conn.info.get("explaining") or pool_probing.get():
+            return
+        route = current_route()
+        rows = _row_count(cursor)
+        slow = elapsed_ms >= query_stats.slow_threshold_ms
+        query_stats.record(route, elapsed_ms, rows, slow)
+        if not slow:
+            return
+
+        label = f"route={route!r} tenant={tenant_schema.get()}: {statement}"
+        slow_query_logger.warning(f"Slow query {elapsed_ms:.1f}ms rows={rows} {label}")
+        if (
+            statement.lstrip().upper().startswith("SELECT")
+            and not executemany
+            and random.random() < query_stats.explain_sample_rate
+        ):
+            _explain_soon(target_engine, statement, parameters, replay_safe(statement), label)
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _handle_error(exception_context):
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("query_start_time"):
+            conn.info["query_start_time"].pop()
+
+
+instrument_engine(engine)
+for replica_engine in replicas.engines:
+    instrument_engine(replica_engine)
@@ -0,0 +1,20 @@
+from redis.asyncio import Redis
+from .config import settings
+from typing import Optional
+
+_redis: Optional[Redis] = None
+
+
+def get_redis() -> Redis:
+    """Process-wide Redis client for settings.REDIS_URL, created on first use."""
+    global _redis
+    if _redis is None:
+        _redis = Redis.from_url(str(settings.REDIS_URL), decode_responses=True)
+    return _redis
+
+
+async def close_redis():
+    global _redis
+    if _redis is not None:
+        await _redis.aclose()
+        _redis = None
@@ -0,0 +1,289 @@
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from .config import settings
+from .models.tenant import User
+from .metrics import metrics
+from .redis_client import get_redis
+from typing import Optional
+import asyncio
+import heapq
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "token_revocations"
+KEY_PREFIX = "revoked:"
+REVOCATION_BACKENDS = ("memory", "redis")
+REVOCATION_BACKEND = settings.REVOCATION_BACKEND or ("memory" if settings.DEBUG else "redis")
+if REVOCATION_BACKEND not in REVOCATION_BACKENDS:
+    raise ValueError(f"Invalid REVOCATION_BACKEND: {REVOCATION_BACKEND}")
+# WEB_CONCURRENCY is the worker count read by uvicorn and gunicorn. With the
+# memory backend a logout would only take effect on the worker serving it.
+if REVOCATION_BACKEND == "memory" and int(os.environ.get("WEB_CONCURRENCY", "1")) > 1:
+    raise ValueError("REVOCATION_BACKEND 'memory' is per process; use 'redis' with more than one worker")
+
+
+def token_subject(tenant_id, user_id) -> str:
+    """"<tenant id|public>:<user id>", as in the token's tenant_id/sub claims."""
+    return f"{tenant_id if tenant_id is not None else 'public'}:{user_id}"
+
+
+def token_subject_from_claims(claims: dict) -> str:
+    return f"{claims.get('tenant_id')}:{claims.get('sub')}"
+
+
+class RevocationStore:
+    """Revoked access tokens, checked in memory on every request.
+
+    Two kinds of entry: a single token by ``jti`` (logout), and a per-user
+    cutoff that revokes every token the user was issued before it
+    (password change, deactivation). Entries are indexed by expiry in a
+    heap and dropped once no token they could match is still valid: a
+    ``jti`` at its token's ``exp``, a cutoff one token lifetime later.
+
+    A cutoff is compared with the token's ``iat``, which the issuing host
+    stamped with its own clock, so it also covers tokens issued up to
+    ``clock_skew`` seconds after it. New tokens for the user are stamped
+    past that window instead (see ``not_before``).
+
+    With the "redis" backend, revocations are also written to Redis and
+    published, and every worker mirrors them into its own store; lookups
+    never leave the process. The "memory" backend keeps them in this
+    process only, which is enough for tests and single-worker setups.
+    """
+
+    def __init__(self, backend: str, token_ttl: float, clock_skew: float = 5.0,
+                 reconnect_delay: float = 1.0, publish_attempts: int = 3):
+        self.backend = backend
+        self.token_ttl = token_ttl
+        self.clock_skew = clock_skew
+        self.reconnect_delay = reconnect_delay
+        self.publish_attempts = publish_attempts
+        self.publish_failures = metrics.counter("revocation.publish_failures")
+        self._jtis: dict[str, float] = {}
+        self._cutoffs: dict[str, tuple[float, float]] = {}
+        self._expiry: list[tuple[float, str, str]] = []
+        self._task: Optional[asyncio.Task] = None
+        self._pending: set[asyncio.Task] = set()
+
+    # Lookups
+
+    def is_revoked(self, claims: dict) -> bool:
+        self._purge(time.time())
+        jti = claims.get("jti")
+        if jti is not None and jti in self._jtis:
+            return True
+        cutoff = self._cutoffs.get(token_subject_from_claims(claims))
+        return cutoff is not None and claims.get("iat", 0) < cutoff[0] + self.clock_skew
+
+    def not_before(self, subject: str) -> float:
+        """Earliest ``iat`` a new token for ``subject`` can have and still be accepted."""
+        self._purge(time.time())
+        cutoff = self._cutoffs.get(subject)
+        return 0.0 if cutoff is None else cutoff[0] + self.clock_skew
+
+    # Local state
+
+    def _purge(self, now: float):
+        while self._expiry and self._expiry[0][0] <= now:
+            expires, kind, key = heapq.heappop(self._expiry)
+            if kind == "jti":
+                if self._jtis.get(key) == expires:
+                    del self._jtis[key]
+            elif self._cutoffs.get(key, (None, None))[1] == expires:
+                del self._cutoffs[key]
+
+    def _apply(self, kind: str, key: str, value: float):
+        now = time.time()
+        if kind == "jti":
+            if value <= now:
+                return
+            self._jtis[key] = value
+            heapq.heappush(self._expiry, (value, kind, key))
+        else:
+            current = self._cutoffs.get(key)
+            if current is not None and current[0] >= value:
+                return
+            expires = value + self.token_ttl
+            if expires <= now:
+                return
+            self._cutoffs[key] = (value, expires)
+            heapq.heappush(self._expiry, (expires, kind, key))
+        self._purge(now)
+
+    # Revoking
+
+    async def revoke_token(self, claims: dict):
+        """Revoke the token with these claims.
+
+        Tokens minted before jti was added are revoked through a user
+        cutoff instead, which also ends that user's other sessions. Raises
+        if the revocation could not be shared with the other workers.
+        """
+        jti = claims.get("jti")
+        if jti is None:
+            await self.revoke_user(token_subject_from_claims(claims))
+            return
+        await self._revoke("jti", jti, float(claims["exp"]))
+
+    async def revoke_user(self, subject: str):
+        """Revoke every token issued to ``subject`` up to now."""
+        self._apply("user", subject, time.time())
+        await self._publish_user(subject, self.publish_attempts)
+
+    async def _revoke(self, kind: str, key: str, value: float):
+        self._apply(kind, key, value)
+        await self._retry(self._publish, self.publish_attempts, kind, key, value)
+
+    async def _publish(self, kind: str, key: str, value: float):
+        if self.backend != "redis":
+            return
+        expires = value if kind == "jti" else value + self.token_ttl
+        redis = get_redis()
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.set(f"{KEY_PREFIX}{kind}:{key}", value, exat=int(expires) + 1)
+            pipe.publish(CHANNEL, json.dumps({"kind": kind, "key": key, "value": value}))
+            await pipe.execute()
+
+    async def _publish_user(self, subject: str, attempts: Optional[int]):
+        if self.backend != "redis":
+            return
+
+        async def publish():
+            # Cutoffs published to other workers all come from Redis's clock.
+            seconds, microseconds = await get_redis().time()
+            value = max(seconds + microseconds / 1e6, self._cutoffs.get(subject, (0.0,))[0])
+            self._apply("user", subject, value)
+            await self._publish("user", subject, value)
+
+        await self._retry(publish, attempts)
+
+    async def _retry(self, publish, attempts: Optional[int], *args):
+        """Run ``publish``, retrying with backoff; ``attempts=None`` retries for a token lifetime."""
+        deadline = time.monotonic() + self.token_ttl
+        delay = self.reconnect_delay
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return await publish(*args)
+            except Exception as e:
+                self.publish_failures.inc()
+                if (attempts is not None and attempt >= attempts) or time.monotonic() + delay > deadline:
+                    raise
+                logger.warning(f"Publishing token revocation failed (attempt {attempt}): {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60.0)
+
+    def revoke_user_soon(self, subject: str):
+        """revoke_user() from synchronous code running on the event loop.
+
+        Takes effect in this process immediately. Redis is written in the
+        background, retried until it succeeds or the revoked tokens have
+        expired anyway.
+        """
+        self._apply("user", subject, time.time())
+        if self.backend != "redis":
+            return
+        task = asyncio.get_running_loop().create_task(self._publish_user(subject, attempts=None))
+        self._pending.add(task)
+        task.add_done_callback(self._revocation_done)
+
+    def _revocation_done(self, task: asyncio.Task):
+        self._pending.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Token revocation was not shared with other workers: {task.exception()}")
+
+    # Redis mirroring
+
+    async def start(self):
+        if self.backend == "redis" and self._task is None:
+            self._task = asyncio.create_task(self._mirror_forever())
+
+    async def stop(self):
+        for task in list(self._pending):
+            task.cancel()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _load(self, redis):
+        async for redis_key in redis.scan_iter(match=f"{KEY_PREFIX}*", count=1000):
+            value = await redis.get(redis_key)
+            if value is None:
+                continue
+            kind, _, key = redis_key[len(KEY_PREFIX):].partition(":")
+            self._apply(kind, key, float(value))
+
+    async def _mirror_forever(self):
+        while True:
+            try:
+                redis = get_redis()
+                async with redis.pubsub() as pubsub:
+                    # Subscribe before loading so nothing published in
+                    # between is missed.
+                    await pubsub.subscribe(CHANNEL)
+                    await self._load(redis)
+                    logger.info(f"Mirroring token revocations from {CHANNEL!r}")
+                    async for message in pubsub.listen():
+                        if message["type"] != "message":
+                            continue
+                        try:
+                            data = json.loads(message["data"])
+                            self._apply(data["kind"], data["key"], float(data["value"]))
+                        except (ValueError, KeyError, TypeError):
+                            logger.warning(f"Ignoring malformed revocation: {message['data']!r}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Revocation mirror error: {e}")
+            await asyncio.sleep(self.reconnect_delay)
+
+    def stats(self) -> dict:
+        return {"backend": self.backend, "jtis": len(self._jtis), "users": len(self._cutoffs)}
+
+
+revocation_store = RevocationStore(
+    backend=REVOCATION_BACKEND,
+    token_ttl=settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+    clock_skew=settings.REVOCATION_CLOCK_SKEW_SECONDS,
+)
+
+
+# --------------------------
+# Revoking on user changes
+# --------------------------
+# A password change, role change or deactivation revokes the user's existing
+# tokens once the change commits; tokens carry the role they were issued for.
+
+@event.listens_for(Session, "after_flush")
+def _collect_revocations(session, flush_context):
+    for obj in session.dirty:
+        if not isinstance(obj, User):
+            continue
+        state = inspect(obj)
+        if state.attrs.password_hash.history.has_changes() or \
+           state.attrs.role_id.history.has_changes() or \
+           (state.attrs.is_active.history.has_changes() and not obj.is_active):
+            session.info.setdefault("revoke_users", set()).add(token_subject(obj.tenant_id, obj.id))
+    for obj in session.deleted:
+        if isinstance(obj, User):
+            session.info.setdefault("revoke_users", set()).add(token_subject(obj.tenant_id, obj.id))
+
+
+@event.listens_for(Session, "after_commit")
+def _revoke_committed_users(session):
+    for subject in session.info.pop("revoke_users", ()):
+        revocation_store.revoke_user_soon(subject)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_revocations(session):
+    session.info.pop("revoke_users", None)
@@ -0,0 +1,403 @@
+from sqlalchemy import String, bindparam, func, or_, select, type_coerce, update
+from .blind_index import blind_index_keys
+from .config import settings
+from .database import AsyncSessionLocal, tenant_schema
+from .encrypted_column import EncryptedString, EncryptedValue, RevealBatch
+from .encryption_service import ENVELOPE_PREFIX, _b64d, _b64e
+from .metrics import metrics
+from .models.tenant import Patient, Provider, RewrapCheckpoint
+from .vault_client import VaultClient
+from datetime import datetime
+from typing import Optional
+import asyncio
+import logging
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+# Tenant columns holding transit ciphertexts ("vault:vN:...") or envelope
+# ciphertexts, whose wrapped data key is a transit ciphertext.
+ENCRYPTED_COLUMNS = [
+    (Patient.__table__, "encrypted_ssn"),
+    (Provider.__table__, "license_number"),
+]
+
+TRANSIT_CIPHERTEXT = re.compile(r"^vault:v(\d+):")
+
+
+def transit_part(value: str) -> Optional[str]:
+    """The transit ciphertext in a stored value, or None for anything else (e.g. plaintext)."""
+    if value.startswith(ENVELOPE_PREFIX):
+        try:
+            value = _b64d(value[len(ENVELOPE_PREFIX):].partition(":")[0]).decode()
+        except ValueError:
+            return None
+    return value if TRANSIT_CIPHERTEXT.match(value) else None
+
+
+def replace_transit_part(value: str, rewrapped: str) -> str:
+    if value.startswith(ENVELOPE_PREFIX):
+        sealed = value[len(ENVELOPE_PREFIX):].partition(":")[2]
+        return f"{ENVELOPE_PREFIX}{_b64e(rewrapped.encode())}:{sealed}"
+    return rewrapped
+
+
+def key_version(ciphertext: str) -> int:
+    return int(TRANSIT_CIPHERTEXT.match(ciphertext).group(1))
+
+
+class RewrapJob:
+    """Moves one tenant's ciphertexts onto the latest version of its transit key.
+
+    Each column is walked in primary key order, ``batch_size`` rows at a
+    time: read a page, rewrap the values still on an older key version
+    with batched transit calls (no Vault call holds a transaction open),
+    then write them back with one executemany UPDATE in the transaction
+    that advances the column's checkpoint. An update only applies where
+    the row still holds the value read, so concurrent writes win. A
+    stopped or crashed job resumes from its checkpoints; a rotation in
+    the meantime starts the columns over on the new version.
+
+    ``max_rows_per_second`` spaces the batches out so that rewrapping
+    millions of rows does not crowd out live traffic.
+    """
+
+    def __init__(self, tenant_id: str, vault_client: VaultClient, batch_size: int,
+                 max_rows_per_second: float, columns=ENCRYPTED_COLUMNS):
+        self.tenant_id = str(tenant_id)
+        self.schema = f"tenant_{tenant_id}"
+        self.vault_client = vault_client
+        self.batch_size = batch_size
+        self.max_rows_per_second = max_rows_per_second
+        self.columns = columns
+        self.state = "pending"
+        self.error: Optional[str] = None
+        self.key_version: Optional[int] = None
+        self.progress: dict[str, dict] = {}
+        self.rows = metrics.counter("vault.rewrap.rows")
+
+    async def run(self):
+        # Runs in its own task, so this only scopes the job's sessions.
+        tenant_schema.set(self.schema)
+        self.state = "running"
+        started = time.perf_counter()
+        try:
+            self.key_version = await self.vault_client.transit_key_version(self.tenant_id)
+            await self._ensure_checkpoints()
+            for table, column in self.columns:
+                await self._rewrap_column(table, column)
+            self.state = "done"
+            logger.info(f"Rewrapped tenant {self.tenant_id} to key v{self.key_version} "
+                        f"in {time.perf_counter() - started:.1f}s")
+        except asyncio.CancelledError:
+            self.state = "stopped"
+            raise
+        except Exception as e:
+            self.state = "failed"
+            self.error = getattr(e, "detail", None) or str(e)
+            logger.error(f"Rewrap of tenant {self.tenant_id} failed: {self.error}")
+
+    async def _ensure_checkpoints(self):
+        # Tenants created before checkpoints existed do not have the table yet.
+        async with AsyncSessionLocal() as db:
+            conn = await db.connection()
+            await conn.run_sync(
+                lambda sync_conn: RewrapCheckpoint.__table__.create(sync_conn, checkfirst=True)
+            )
+            await db.commit()
+
+    async def _load_checkpoint(self, table_name: str, column: str) -> RewrapCheckpoint:
+        async with AsyncSessionLocal() as db:
+            checkpoint = await db.get(RewrapCheckpoint, (table_name, column))
+            if checkpoint is None:
+                checkpoint = RewrapCheckpoint(table_name=table_name, column_name=column)
+                db.add(checkpoint)
+            if checkpoint.key_version != self.key_version:
+                checkpoint.key_version = self.key_version
+                checkpoint.last_id = 0
+                checkpoint.rows_rewrapped = 0
+                checkpoint.completed_at = None
+            await db.commit()
+            return checkpoint
+
+    async def _rewrap_column(self, table, column: str):
+        checkpoint = await self._load_checkpoint(table.name, column)
+        progress = self.progress[f"{table.name}.{column}"] = {
+            "last_id": checkpoint.last_id,
+            "rows_scanned": 0,
+            "rows_rewrapped": checkpoint.rows_rewrapped,
+            "done": checkpoint.completed_at is not None,
+        }
+        if progress["done"]:
+            return
+
+        # Raw strings: EncryptedString would hand back EncryptedValues and
+        # refuse plain str parameters.
+        values = type_coerce(table.c[column], String)
+        page = (
+            select(table.c.id, values)
+            .where(table.c.id > bindparam("after"), values.isnot(None))
+            .order_by(table.c.id)
+            .limit(self.batch_size)
+        )
+        write = (
+            update(table)
+            .where(table.c.id == bindparam("row_id"), values == bindparam("old_value", type_=String))
+            .values({column: bindparam("new_value", type_=String)})
+        )
+
+        last_id = checkpoint.last_id
+        while True:
+            started = time.monotonic()
+            async with AsyncSessionLocal() as db:
+                rows = (await db.execute(page, {"after": last_id})).all()
+            if not rows:
+                break
+
+            stale = []
+            for row_id, value in rows:
+                part = transit_part(value)
+                if part is not None and key_version(part) < self.key_version:
+                    stale.append((row_id, value, part))
+            # Envelope values share wrapped keys; rewrap each one once.
+            unique = list(dict.fromkeys(part for _, _, part in stale))
+            rewrapped = dict(zip(unique, await self.vault_client.rewrap_batch(self.tenant_id, unique))) \
+                if unique else {}
+            last_id = rows[-1][0]
+
+            async with AsyncSessionLocal() as db:
+                if stale:
+                    await db.execute(write, [
+                        {"row_id": row_id, "old_value": value,
+                         "new_value": replace_transit_part(value, rewrapped[part])}
+                        for row_id, value, part in stale
+                    ])
+                checkpoint = await db.get(RewrapCheckpoint, (table.name, column))
+                checkpoint.last_id = last_id
+                checkpoint.rows_rewrapped += len(stale)
+                await db.commit()
+
+            self.rows.inc(len(stale))
+            progress.update(last_id=last_id, rows_rewrapped=checkpoint.rows_rewrapped)
+            progress["rows_scanned"] += len(rows)
+
+            if self.max_rows_per_second:
+                elapsed = time.monotonic() - started
+                await asyncio.sleep(max(len(rows) / self.max_rows_per_second - elapsed, 0))
+
+        async with AsyncSessionLocal() as db:
+            checkpoint = await db.get(RewrapCheckpoint, (table.name, column))
+            checkpoint.completed_at = datetime.utcnow()
+            await db.commit()
+        progress["done"] = True
+
+    def status(self) -> dict:
+        return {
+            "tenant_id": self.tenant_id,
+            "state": self.state,
+            "key_version": self.key_version,
+            "error": self.error,
+            "columns": self.progress,
+        }
+
+
+def blind_indexed_columns(tables=(Patient.__table__,)) -> list:
+    """(table, encrypted column, index column) for each EncryptedString with a blind index."""
+    return [
+        (table, column.name, column.type.blind_index)
+        for table in tables for column in table.columns
+        if isinstance(column.type, EncryptedString) and column.type.blind_index
+    ]
+
+
+class BlindIndexReindexJob:
+    """Recomputes one tenant's blind indexes under its current key version.
+
+    Backfills rows without an index value and moves rows indexed under
+    an older version after a rotation. It first waits out the key cache
+    TTL, so every worker indexes new writes with the current key, then
+    walks each column in primary key order: read a page, decrypt the
+    stale values in one batch, and write their index values with one
+    executemany UPDATE that only applies where the row still holds the
+    ciphertext read. Once no row is left on an older version, those
+    versions are retired. Rows already on the current version are
+    skipped, so a stopped job is simply started again.
+    """
+
+    def __init__(self, tenant_id: str, batch_size: int, max_rows_per_second: float,
+                 columns=None):
+        self.tenant_id = str(tenant_id)
+        self.schema = f"tenant_{tenant_id}"
+        self.batch_size = batch_size
+        self.max_rows_per_second = max_rows_per_second
+        self.columns = columns if columns is not None else blind_indexed_columns()
+        self.state = "pending"
+        self.error: Optional[str] = None
+        self.key_version: Optional[int] = None
+        self.progress: dict[str, dict] = {}
+        self.rows = metrics.counter("blind_index.reindex.rows")
+
+    async def run(self):
+        tenant_schema.set(self.schema)
+        self.state = "running"
+        started = time.perf_counter()
+        try:
+            blind_index_keys.invalidate(self.tenant_id)
+            keys = await blind_index_keys.get(self.tenant_id)
+            if len(keys.keys) > 1:
+                # Workers may still index writes with the previous version.
+                self.state = "waiting"
+                await asyncio.sleep(blind_index_keys.ttl)
+                self.state = "running"
+            self.key_version = keys.current
+            for table, column, index_column in self.columns:
+                await self._reindex_column(table, column, index_column)
+            if await self._stale_rows():
+                self.state = "incomplete"
+                logger.warning(f"Blind indexes of tenant {self.tenant_id} still have rows "
+                               f"before v{self.key_version}; older keys kept")
+                return
+            await blind_index_keys.retire(self.tenant_id, self.key_version)
+            self.state = "done"
+            logger.info(f"Reindexed tenant {self.tenant_id} to blind-index key v{self.key_version} "
+                        f"in {time.perf_counter() - started:.1f}s")
+        except asyncio.CancelledError:
+            self.state = "stopped"
+            raise
+        except Exception as e:
+            self.state = "failed"
+            self.error = getattr(e, "detail", None) or str(e)
+            logger.error(f"Blind-index reindex of tenant {self.tenant_id} failed: {self.error}")
+
+    def _stale(self, table, index_column: str):
+        index = table.c[index_column]
+        return or_(index.is_(None), ~index.startswith(f"{self.key_version}:"))
+
+    async def _stale_rows(self) -> int:
+        stale = 0
+        async with AsyncSessionLocal() as db:
+            for table, column, index_column in self.columns:
+                stale += (await db.execute(
+                    select(func.count()).select_from(table).where(
+                        type_coerce(table.c[column], String).isnot(None),
+                        self._stale(table, index_column),
+                    )
+                )).scalar()
+        return stale
+
+    async def _reindex_column(self, table, column: str, index_column: str):
+        progress = self.progress[f"{table.name}.{column}"] = {
+            "last_id": 0,
+            "rows_scanned": 0,
+            "rows_reindexed": 0,
+            "done": False,
+        }
+        values = type_coerce(table.c[column], String)
+        page = (
+            select(table.c.id, values, table.c[index_column])
+            .where(table.c.id > bindparam("after"), values.isnot(None))
+            .order_by(table.c.id)
+            .limit(self.batch_size)
+        )
+        write = (
+            update(table)
+            .where(table.c.id == bindparam("row_id"), values == bindparam("old_value", type_=String))
+            .values({index_column: bindparam("index_value")})
+        )
+
+        last_id = 0
+        while True:
+            started = time.monotonic()
+            async with AsyncSessionLocal() as db:
+                rows = (await db.execute(page, {"after": last_id})).all()
+            if not rows:
+                break
+
+            prefix = f"{self.key_version}:"
+            stale = [(row_id, value) for row_id, value, index in rows
+                     if index is None or not index.startswith(prefix)]
+            if stale:
+                batch = RevealBatch()
+                revealed = [EncryptedValue(value, self.tenant_id) for _, value in stale]
+                for value in revealed:
+                    batch.add(value)
+                # The first reveal decrypts the whole page.
+                plaintexts = [await value.reveal() for value in revealed]
+                keys = await blind_index_keys.get(self.tenant_id)
+                async with AsyncSessionLocal() as db:
+                    await db.execute(write, [
+                        {"row_id": row_id, "old_value": value,
+                         "index_value": keys.digest(plaintext, self.key_version)}
+                        for (row_id, value), plaintext in zip(stale, plaintexts)
+                    ])
+                    await db.commit()
+            last_id = rows[-1][0]
+
+            self.rows.inc(len(stale))
+            progress["last_id"] = last_id
+            progress["rows_scanned"] += len(rows)
+            progress["rows_reindexed"] += len(stale)
+
+            if self.max_rows_per_second:
+                elapsed = time.monotonic() - started
+                await asyncio.sleep(max(len(rows) / self.max_rows_per_second - elapsed, 0))
+        progress["done"] = True
+
+    def status(self) -> dict:
+        return {
+            "tenant_id": self.tenant_id,
+            "state": self.state,
+            "key_version": self.key_version,
+            "error": self.error,
+            "columns": self.progress,
+        }
+
+
+class TenantJobs:
+    """Background jobs of one kind started in this process, at most one running per tenant.
+
+    Jobs on different workers for the same tenant are safe (their updates
+    are conditional) but do the work twice, so start them from one place.
+    """
+
+    def __init__(self, make_job):
+        self.make_job = make_job
+        self._jobs: dict[str, object] = {}
+        self._tasks: dict[str, asyncio.Task] = {}
+
+    def start(self, tenant_id: str):
+        tenant_id = str(tenant_id)
+        task = self._tasks.get(tenant_id)
+        if task is not None and not task.done():
+            return self._jobs[tenant_id]
+        job = self.make_job(tenant_id)
+        self._jobs[tenant_id] = job
+        self._tasks[tenant_id] = asyncio.create_task(job.run())
+        return job
+
+    def get(self, tenant_id: str):
+        return self._jobs.get(str(tenant_id))
+
+    async def stop(self):
+        for task in self._tasks.values():
+            task.cancel()
+        for task in self._tasks.values():
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks.clear()
+
+
+rewrap_jobs = TenantJobs(lambda tenant_id: RewrapJob(
+    tenant_id,
+    VaultClient(),
+    batch_size=settings.REWRAP_BATCH_SIZE,
+    max_rows_per_second=settings.REWRAP_MAX_ROWS_PER_SECOND,
+))
+reindex_jobs = TenantJobs(lambda tenant_id: BlindIndexReindexJob(
+    tenant_id,
+    batch_size=settings.REWRAP_BATCH_SIZE,
+    max_rows_per_second=settings.REWRAP_MAX_ROWS_PER_SECOND,
+))
@@ -1,7 +1,13 @@
 from passlib.context import CryptContext
 from jose import jwt
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
 from datetime import datetime, timedelta
+from typing import Optional
+from uuid import uuid4
 from .config import settings
+from .metrics import metrics
+import asyncio
+import time
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -11,12 +17,89 @@ def verify_password(plain_password: str, hashed_password: str):
 def get_password_hash(password: str):
     return pwd_context.hash(password)
 
+
+class PasswordHasher:
+    """Runs bcrypt off the event loop, at most ``workers`` calls at a time.
+
+    A bcrypt round takes hundreds of milliseconds of CPU; run inline it
+    stalls every other request on the worker. Callers beyond the limit wait
+    on a semaphore, which is what ``auth.password.queue_depth`` reports.
+    """
+
+    def __init__(self, workers: int, executor: str = "thread"):
+        if executor not in ("thread", "process"):
+            raise ValueError(f"Invalid PASSWORD_HASH_EXECUTOR: {executor}")
+        self.workers = workers
+        self.executor_kind = executor
+        self._executor: Optional[Executor] = None
+        self._slots = asyncio.Semaphore(workers)
+        self.queue_depth = metrics.gauge("auth.password.queue_depth")
+        self.in_flight = metrics.gauge("auth.password.in_flight")
+        self.wait_ms = metrics.histogram("auth.password.wait_ms")
+        self.run_ms = metrics.histogram("auth.password.run_ms")
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.executor_kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="password-hash"
+                )
+        return self._executor
+
+    async def _run(self, fn, *args):
+        queued = time.perf_counter()
+        self.queue_depth.inc()
+        try:
+            await self._slots.acquire()
+        finally:
+            self.queue_depth.dec()
+        started = time.perf_counter()
+        self.wait_ms.observe((started - queued) * 1000)
+        self.in_flight.inc()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self.in_flight.dec()
+            self.run_ms.observe((time.perf_counter() - started) * 1000)
+            self._slots.release()
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(verify_password, plain_password, hashed_password)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(get_password_hash, password)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+password_hasher = PasswordHasher(
+    workers=settings.PASSWORD_HASH_WORKERS,
+    executor=settings.PASSWORD_HASH_EXECUTOR,
+)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await password_hasher.verify(plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    return await password_hasher.hash(password)
+
 def create_access_token(data: dict) -> str:
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    # jti identifies the token for logout; iat (sub-second) is compared
+    # against per-user revocation cutoffs, so a token issued right after
+    # one is stamped past its clock-skew window.
+    from .revocation import revocation_store, token_subject_from_claims
+    iat = max(time.time(), revocation_store.not_before(token_subject_from_claims(data)))
+    to_encode.update({"exp": expire, "iat": iat, "jti": uuid4().hex})
     return jwt.encode(
         to_encode,
         settings.JWT_SECRET,
         algorithm=settings.JWT_ALGORITHM
-    )
\ No newline at end of file
+    )
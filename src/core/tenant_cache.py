@@ -0,0 +1,295 @@
+from collections import OrderedDict
+from types import MappingProxyType
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+from .database import AsyncSessionLocal
+from .invalidation import invalidation_bus
+from .models.public import Tenant
+from .config import settings
+import asyncio
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Columns that decide which host a tenant is served on
+ROUTING_ATTRIBUTES = ("subdomain", "custom_domain", "is_active")
+
+
+def _frozen(value):
+    """Deep read-only copy of a JSON column value: dicts become mappingproxies, lists tuples."""
+    if isinstance(value, dict):
+        return MappingProxyType({k: _frozen(v) for k, v in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(_frozen(v) for v in value)
+    return value
+
+
+class TenantSnapshot:
+    """Read-only copy of a Tenant row that is safe to share across requests.
+
+    JSON columns (compliance settings, onboarding data, ...) are deep-copied
+    and frozen too, so no request can change what the next one sees.
+    """
+
+    __slots__ = tuple(column.key for column in Tenant.__table__.columns)
+
+    def __init__(self, tenant: Tenant):
+        for key in self.__slots__:
+            object.__setattr__(self, key, _frozen(getattr(tenant, key)))
+
+    def __setattr__(self, key, value):
+        raise AttributeError("TenantSnapshot is read-only")
+
+    def __repr__(self):
+        return f"<TenantSnapshot id={self.id} subdomain={self.subdomain!r}>"
+
+
+class TenantCache:
+    """Bounded host -> tenant cache with a TTL per entry."""
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: "OrderedDict[tuple, tuple[float, TenantSnapshot]]" = OrderedDict()
+        self._keys_by_tenant: dict[int, set] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, snapshot = entry
+        if expires_at < time.monotonic():
+            self._evict(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return snapshot
+
+    def set(self, key: tuple, tenant: Tenant) -> TenantSnapshot:
+        snapshot = tenant if isinstance(tenant, TenantSnapshot) else TenantSnapshot(tenant)
+        if key in self._entries:
+            self._evict(key)
+        self._entries[key] = (time.monotonic() + self.ttl, snapshot)
+        self._keys_by_tenant.setdefault(snapshot.id, set()).add(key)
+        while len(self._entries) > self.max_size:
+            oldest = next(iter(self._entries))
+            self._evict(oldest)
+        return snapshot
+
+    def invalidate_tenant(self, tenant_id: int):
+        """Drop every cached host that resolves to ``tenant_id``."""
+        for key in list(self._keys_by_tenant.get(tenant_id, ())):
+            self._evict(key)
+        logger.debug(f"Invalidated tenant cache for tenant {tenant_id}")
+
+    def clear(self):
+        self._entries.clear()
+        self._keys_by_tenant.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def _evict(self, key: tuple):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        tenant_id = entry[1].id
+        keys = self._keys_by_tenant.get(tenant_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_tenant[tenant_id]
+
+
+class NegativeCache:
+    """Short-lived, bounded record of hosts that resolved to no tenant."""
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: "OrderedDict[tuple, float]" = OrderedDict()
+        self.hits = 0
+
+    def __contains__(self, key: tuple) -> bool:
+        expires_at = self._entries.get(key)
+        if expires_at is None:
+            return False
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return False
+        self.hits += 1
+        return True
+
+    def add(self, key: tuple):
+        self._entries.pop(key, None)
+        self._entries[key] = time.monotonic() + self.ttl
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "ttl": self.ttl, "hits": self.hits}
+
+
+class KnownHostIndex:
+    """Set of every active tenant subdomain and custom domain.
+
+    Lets the middleware reject hosts that cannot belong to any tenant without
+    a pool checkout. Exact sets are used rather than a Bloom filter: tenant
+    counts are small enough that the memory difference is negligible and
+    there are no false positives to fall through to the database.
+    """
+
+    def __init__(self, refresh_interval: float):
+        self.refresh_interval = refresh_interval
+        self._keys: frozenset = frozenset()
+        self._loaded_at = None
+        self._stale = True
+        self._lock = asyncio.Lock()
+        self.rejected = 0
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded_at is not None
+
+    def is_stale(self) -> bool:
+        if self._stale or self._loaded_at is None:
+            return True
+        return time.monotonic() - self._loaded_at > self.refresh_interval
+
+    def mark_stale(self):
+        self._stale = True
+
+    def may_contain(self, key: tuple) -> bool:
+        # Until the first successful load, let every host through to the DB.
+        if not self.loaded:
+            return True
+        if key in self._keys:
+            return True
+        self.rejected += 1
+        return False
+
+    async def rebuild(self):
+        """Reload the index from public.tenants."""
+        async with self._lock:
+            await self._load()
+
+    async def refresh_if_stale(self):
+        if not self.is_stale():
+            return
+        async with self._lock:
+            # Another request may have reloaded while we waited for the lock.
+            if self.is_stale():
+                await self._load()
+
+    async def _load(self):
+        # Cleared up front so a mark_stale() racing with the query is kept.
+        self._stale = False
+        try:
+            async with AsyncSessionLocal() as session:
+                result = await session.execute(
+                    select(Tenant.subdomain, Tenant.custom_domain).where(Tenant.is_active == True)
+                )
+                rows = result.all()
+        except Exception as e:
+            self._stale = True
+            logger.error(f"Failed to rebuild known tenant hosts: {e}")
+            return
+        keys = set()
+        for subdomain, custom_domain in rows:
+            if subdomain:
+                keys.add(subdomain_key(subdomain))
+            if custom_domain:
+                keys.add(custom_domain_key(custom_domain))
+        self._keys = frozenset(keys)
+        self._loaded_at = time.monotonic()
+        logger.debug(f"Rebuilt known tenant hosts: {len(keys)} entries")
+
+    def stats(self) -> dict:
+        return {"size": len(self._keys), "loaded": self.loaded, "rejected": self.rejected}
+
+
+tenant_cache = TenantCache(
+    ttl=settings.TENANT_CACHE_TTL_SECONDS,
+    max_size=settings.TENANT_CACHE_MAX_SIZE,
+)
+negative_tenant_cache = NegativeCache(
+    ttl=settings.TENANT_NEGATIVE_CACHE_TTL_SECONDS,
+    max_size=settings.TENANT_NEGATIVE_CACHE_MAX_SIZE,
+)
+known_hosts = KnownHostIndex(refresh_interval=settings.KNOWN_HOSTS_REFRESH_SECONDS)
+
+
+def invalidate_tenant(tenant_id: int):
+    """Evict a tenant everywhere hosts are cached after its routing changed."""
+    tenant_cache.invalidate_tenant(tenant_id)
+    negative_tenant_cache.clear()
+    known_hosts.mark_stale()
+
+
+def _on_tenant_invalidated(key):
+    if key is None:
+        tenant_cache.clear()
+        negative_tenant_cache.clear()
+        known_hosts.mark_stale()
+    else:
+        invalidate_tenant(int(key))
+
+
+# Writes committed by other workers arrive over LISTEN/NOTIFY.
+invalidation_bus.subscribe("tenant", _on_tenant_invalidated)
+
+
+def subdomain_key(subdomain: str) -> tuple:
+    return ("subdomain", subdomain)
+
+
+def custom_domain_key(host: str) -> tuple:
+    return ("custom_domain", host)
+
+
+# --------------------------
+# Invalidation on tenant writes
+# --------------------------
+# Changed tenants are collected at flush time and evicted only once the
+# transaction commits, so a concurrent request cannot re-cache the old row
+# between the eviction and the commit.
+
+@event.listens_for(Session, "after_flush")
+def _collect_tenant_changes(session, flush_context):
+    changed = session.info.setdefault("tenant_cache_changed", set())
+    for obj in session.new:
+        if isinstance(obj, Tenant):
+            changed.add(obj.id)
+    for obj in session.dirty:
+        if isinstance(obj, Tenant):
+            state = inspect(obj)
+            if any(state.attrs[attr].history.has_changes() for attr in ROUTING_ATTRIBUTES):
+                changed.add(obj.id)
+    for obj in session.deleted:
+        if isinstance(obj, Tenant):
+            changed.add(obj.id)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed_tenants(session):
+    for tenant_id in session.info.pop("tenant_cache_changed", ()):
+        invalidate_tenant(tenant_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_tenant_changes(session):
+    session.info.pop("tenant_cache_changed", None)
@@ -0,0 +1,75 @@
+from sqlalchemy import text
+from .database import engine
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Tenant tables are created with TenantAwareBase.metadata.create_all when a
+# tenant subscribes, which never alters a table that already exists. Column
+# changes made after that are listed here and applied to every tenant schema
+# that still needs them when the app starts, before it serves requests.
+
+
+def _tenant_tables(table: str, condition: str) -> str:
+    """Tenant schemas that have ``table`` and for which ``condition`` holds."""
+    return f"""
+        SELECT t.table_schema FROM information_schema.tables t
+        WHERE t.table_schema LIKE 'tenant\\_%' AND t.table_name = '{table}' AND {condition}
+    """
+
+
+def missing_column(table: str, column: str) -> str:
+    return _tenant_tables(table, f"""NOT EXISTS (
+        SELECT 1 FROM information_schema.columns c
+        WHERE c.table_schema = t.table_schema AND c.table_name = t.table_name
+          AND c.column_name = '{column}')""")
+
+
+def narrower_column(table: str, column: str, length: int) -> str:
+    return _tenant_tables(table, f"""EXISTS (
+        SELECT 1 FROM information_schema.columns c
+        WHERE c.table_schema = t.table_schema AND c.table_name = t.table_name
+          AND c.column_name = '{column}' AND c.character_maximum_length < {length})""")
+
+
+# (description, query returning the schemas that need it, statements with {schema})
+TENANT_UPGRADES = [
+    (
+        "patients.ssn_index blind index",
+        missing_column("patients", "ssn_index"),
+        [
+            "ALTER TABLE {schema}.patients ADD COLUMN IF NOT EXISTS ssn_index VARCHAR(64)",
+            "CREATE INDEX IF NOT EXISTS ix_patients_ssn_index ON {schema}.patients (ssn_index)",
+        ],
+    ),
+    (
+        "providers.license_number widened for ciphertexts",
+        narrower_column("providers", "license_number", 1024),
+        ["ALTER TABLE {schema}.providers ALTER COLUMN license_number TYPE VARCHAR(1024)"],
+    ),
+    (
+        "patients.encrypted_ssn widened for ciphertexts",
+        narrower_column("patients", "encrypted_ssn", 1200),
+        ["ALTER TABLE {schema}.patients ALTER COLUMN encrypted_ssn TYPE VARCHAR(1200)"],
+    ),
+]
+
+
+async def upgrade_tenant_schemas(lock_timeout: str = "5s"):
+    """Apply pending TENANT_UPGRADES, one transaction per tenant schema.
+
+    A schema that fails (e.g. a lock not granted within ``lock_timeout``)
+    is logged and left for the next start; the others are still upgraded.
+    """
+    for description, pending, statements in TENANT_UPGRADES:
+        async with engine.connect() as conn:
+            schemas = (await conn.execute(text(pending))).scalars().all()
+        for schema in schemas:
+            try:
+                async with engine.begin() as conn:
+                    await conn.execute(text(f"SET LOCAL lock_timeout = '{lock_timeout}'"))
+                    for statement in statements:
+                        await conn.execute(text(statement.format(schema=schema)))
+                logger.info(f"Upgraded {schema}: {description}")
+            except Exception as e:
+                logger.error(f"Upgrading {schema} ({description}) failed: {e}")
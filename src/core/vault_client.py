@@ -1,7 +1,15 @@
-import hvac
+import httpx
 import os
 from fastapi import HTTPException
-from typing import List
+from typing import List, Optional
+from .config import settings
+from .vault_memory import InMemoryVault
+import asyncio
+import logging
+import random
+import time
+
+logger = logging.getLogger(__name__)
 
 # Vault Configuration (Read from environment variables)
 VAULT_ADDR = os.getenv("VAULT_ADDR", "http://35.239.94.67:8200")
@@ -10,9 +18,6 @@ VAULT_TOKEN = os.getenv("VAULT_TOKEN","hvs.afRXhGgU351MpShcsLhUAN21")  # Secure
 if not VAULT_TOKEN:
     raise ValueError("Vault token is missing! Set VAULT_TOKEN as an environment variable.")
 
-# Initialize Vault Client
-client = hvac.Client(url=VAULT_ADDR, token=VAULT_TOKEN)
-
 # Role-based Policies (Fixed paths to kv/data/)
 ROLE_POLICIES = {
     "super_admin": """
@@ -25,6 +30,9 @@ ROLE_POLICIES = {
         path "transit/decrypt/{tenant_id}-transit" {
             capabilities = ["update"]
         }
+        path "transit/datakey/plaintext/{tenant_id}-transit" {
+            capabilities = ["update"]
+        }
     """,
     "clinic_admin": """
         path "kv/data/tenants/{tenant_id}/*" {
@@ -36,6 +44,9 @@ ROLE_POLICIES = {
         path "transit/decrypt/{tenant_id}-transit" {
             capabilities = ["update"]
         }
+        path "transit/datakey/plaintext/{tenant_id}-transit" {
+            capabilities = ["update"]
+        }
     """,
     "doctor": """
         path "kv/data/tenants/{tenant_id}/patients/*" {
@@ -63,84 +74,264 @@ ROLE_POLICIES = {
     """
 }
 
+class VaultError(Exception):
+    def __init__(self, status: int, errors: list):
+        self.status = status
+        self.errors = errors
+        super().__init__(f"Vault returned {status}: {'; '.join(map(str, errors)) or 'no details'}")
+
+
+class VaultForbidden(VaultError):
+    pass
+
+
+class VaultNotFound(VaultError):
+    pass
+
+
+# Statuses worth another attempt: Vault sealed, overloaded or restarting
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class AsyncVault:
+    """Vault HTTP API over one pooled async connection.
+
+    Holds no token: every call names the token it runs as, so concurrent
+    requests for different tenants and roles never share auth state.
+    Calls that never reached Vault are retried with exponential backoff
+    and jitter; 429/5xx responses and broken connections only for calls
+    that are ``idempotent``.
+    """
+
+    def __init__(self, addr: str, timeout: float, max_retries: int, backoff: float,
+                 max_connections: int, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.addr = addr
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_connections = max_connections
+        self.transport = transport
+        self._http: Optional[httpx.AsyncClient] = None
+
+    def _client(self) -> httpx.AsyncClient:
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                base_url=self.addr,
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+                transport=self.transport,
+            )
+        return self._http
+
+    async def request(self, method: str, path: str, token: str, json: Optional[dict] = None,
+                      idempotent: bool = True) -> Optional[dict]:
+        attempt = 0
+        while True:
+            try:
+                response = await self._client().request(
+                    method, f"/v1/{path}", json=json, headers={"X-Vault-Token": token}
+                )
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+                # The request never reached Vault, so it is always safe to resend.
+                error = e
+            except httpx.TransportError as e:
+                if not idempotent:
+                    raise
+                error = e
+            else:
+                if response.status_code < 400:
+                    return response.json() if response.content else None
+                errors = response.json().get("errors", []) if response.content else []
+                if response.status_code == 403:
+                    raise VaultForbidden(403, errors)
+                if response.status_code == 404:
+                    raise VaultNotFound(404, errors)
+                error = VaultError(response.status_code, errors)
+                if response.status_code not in RETRY_STATUSES or not idempotent:
+                    raise error
+
+            if attempt >= self.max_retries:
+                raise error
+            delay = self.backoff * (2 ** attempt)
+            logger.warning(f"Vault {method} {path} failed ({error}), retrying in {delay:.2f}s")
+            await asyncio.sleep(delay + random.uniform(0, delay))
+            attempt += 1
+
+    async def transit(self, operation: str, key_name: str, token: str, **params) -> dict:
+        """POST transit/<operation>/<key>; returns the response's ``data``."""
+        response = await self.request("POST", f"transit/{operation}/{key_name}", token, json=params)
+        return response["data"]
+
+    async def aclose(self):
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+
+vault_http = AsyncVault(
+    VAULT_ADDR,
+    timeout=settings.VAULT_TIMEOUT_SECONDS,
+    max_retries=settings.VAULT_MAX_RETRIES,
+    backoff=settings.VAULT_RETRY_BACKOFF_SECONDS,
+    max_connections=settings.VAULT_MAX_CONNECTIONS,
+    transport=InMemoryVault(root_token=VAULT_TOKEN) if settings.VAULT_IN_MEMORY else None,
+)
+
+
 class VaultClient:
-    def __init__(self):
-        self.client = client
+    def __init__(self, vault: AsyncVault = vault_http, token: str = VAULT_TOKEN):
+        self.vault = vault
+        self.token = token
 
-    def create_vault_policy(self, tenant_id: str, role: str):
+    async def create_vault_policy(self, tenant_id: str, role: str):
         """Create a Vault policy for a specific tenant and role."""
         if role not in ROLE_POLICIES:
             raise ValueError(f"Invalid role: {role}")
 
         policy_content = ROLE_POLICIES[role].replace("{tenant_id}", tenant_id)
-        self.client.sys.create_or_update_policy(
-            name=f"{role}-policy-{tenant_id}",
-            policy=policy_content
+        await self.vault.request(
+            "PUT", f"sys/policy/{role}-policy-{tenant_id}", self.token,
+            json={"policy": policy_content}
         )
 
-    def generate_token(self, tenant_id: str, role: str):
+    async def generate_token(self, tenant_id: str, role: str):
         """Generate a Vault token for a role under a tenant."""
         policy_name = f"{role}-policy-{tenant_id}"
-        response = self.client.auth.token.create(
-            policies=[policy_name],
-            renewable=True,
-            ttl="24h"
+        response = await self.vault.request(
+            "POST", "auth/token/create", self.token,
+            json={
+                "policies": [policy_name],
+                "renewable": True,
+                "ttl": f"{settings.VAULT_TOKEN_TTL_SECONDS}s"
+            },
+            # A resent create would mint a second token
+            idempotent=False,
         )
         return response["auth"]["client_token"]
 
-    def store_token_in_vault(self, tenant_id: str, role: str, token: str):
+    async def store_token_in_vault(self, tenant_id: str, role: str, token: str):
         """Store generated token securely in Vault under the correct KV v2 path."""
-        path = f"kv/data/tenants/{tenant_id}/tokens/{role}"
         try:
-            self.client.secrets.kv.v2.create_or_update_secret(
-                mount_point="kv",  # Specify mount point explicitly
-                path=f"tenants/{tenant_id}/tokens/{role}",
-                secret={"token": token}
+            await self.vault.request(
+                "POST", f"kv/data/tenants/{tenant_id}/tokens/{role}", self.token,
+                json={"data": {"token": token}}
             )
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error storing token in Vault: {str(e)}")
 
-    def get_vault_token(self, tenant_id: str, role: str):
+    async def get_vault_token(self, tenant_id: str, role: str):
         """Retrieve a token from Vault for a specific tenant and role."""
         try:
-            path = f"tenants/{tenant_id}/tokens/{role}"
-            response = self.client.secrets.kv.v2.read_secret_version(
-                mount_point="kv",
-                path=path
+            response = await self.vault.request(
+                "GET", f"kv/data/tenants/{tenant_id}/tokens/{role}", self.token
             )
             return response["data"]["data"]["token"]
-        except hvac.exceptions.InvalidPath:
+        except VaultNotFound:
             raise HTTPException(status_code=404, detail=f"Token not found for {role} in tenant {tenant_id}")
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
 
-    async def register_tenant(self, tenant_id: str, roles: List):
-        """Register a new tenant and create Vault policies dynamically based on database roles."""
+    async def revoke_token(self, token: str):
+        await self.vault.request("POST", "auth/token/revoke-self", token, idempotent=False)
+
+    async def _stored_token(self, tenant_id: str, role: str) -> Optional[str]:
+        """The role token in KV, if there is one and Vault still accepts it."""
+        try:
+            response = await self.vault.request(
+                "GET", f"kv/data/tenants/{tenant_id}/tokens/{role}", self.token
+            )
+        except VaultNotFound:
+            return None
+        token = response["data"]["data"]["token"]
         try:
-            # Step 1: Create a transit key
-            self.create_transit_key(tenant_id)
+            await self.vault.request("GET", "auth/token/lookup-self", token)
+        except VaultForbidden:
+            return None
+        return token
 
-            # Step 2: Create policies and tokens
-            for role in roles:
-                self.create_vault_policy(tenant_id, role.name)
-                token = self.generate_token(tenant_id, role.name)
-                self.store_token_in_vault(tenant_id, role.name, token)
+    async def _provision_role(self, tenant_id: str, role: str, step):
+        await step("policy", role, lambda: self.create_vault_policy(tenant_id, role))
+        if await step("token_lookup", role, lambda: self._stored_token(tenant_id, role)):
+            return
+        token = await step("token_create", role, lambda: self.generate_token(tenant_id, role))
+        try:
+            await step("token_store", role, lambda: self.store_token_in_vault(tenant_id, role, token))
+        except Exception:
+            # Unstored, the token is unreachable; the next run mints another.
+            try:
+                await self.revoke_token(token)
+            except Exception as e:
+                logger.warning(f"Could not revoke unstored {role} token for tenant {tenant_id}: {e}")
+            raise
 
-            return {"message": f"Tenant {tenant_id} registered, transit key & policies created!"}
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=str(e))
+    async def register_tenant(self, tenant_id: str, roles: List, concurrency: Optional[int] = None):
+        """Register a new tenant and create Vault policies dynamically based on database roles.
 
-        
-    def create_transit_key(self, tenant_id: str):
+        The transit key and each role are provisioned concurrently, at most
+        ``concurrency`` Vault calls at a time. Every step is idempotent and
+        roles whose stored token is still valid are skipped, so after a
+        partial failure running this again finishes the job. The result
+        (or the 500's detail) lists each step with its duration.
+        """
+        role_names = [role.name for role in roles]
+        invalid = [name for name in role_names if name not in ROLE_POLICIES]
+        if invalid:
+            raise HTTPException(status_code=500, detail=f"Invalid role: {', '.join(invalid)}")
+
+        slots = asyncio.Semaphore(concurrency or settings.VAULT_REGISTER_CONCURRENCY)
+        steps = []
+
+        async def step(name: str, role: Optional[str], call):
+            async with slots:
+                started = time.perf_counter()
+                entry = {"step": name, "role": role}
+                try:
+                    result = await call()
+                except Exception as e:
+                    entry.update(ok=False, error=getattr(e, "detail", None) or str(e))
+                    raise
+                else:
+                    entry["ok"] = True
+                    return result
+                finally:
+                    entry["ms"] = round((time.perf_counter() - started) * 1000, 1)
+                    steps.append(entry)
+
+        started = time.perf_counter()
+        results = await asyncio.gather(
+            step("transit_key", None, lambda: self.create_transit_key(tenant_id)),
+            *(self._provision_role(tenant_id, name, step) for name in role_names),
+            return_exceptions=True,
+        )
+        total_ms = round((time.perf_counter() - started) * 1000, 1)
+        failed = [result for result in results if isinstance(result, BaseException)]
+        logger.info(f"Vault registration of tenant {tenant_id}: {len(steps)} steps, "
+                    f"{len(failed)} failed, {total_ms}ms")
+        if failed:
+            raise HTTPException(status_code=500, detail={
+                "message": f"Registration of tenant {tenant_id} incomplete; run it again to resume",
+                "steps": steps,
+                "total_ms": total_ms,
+            })
+        return {
+            "message": f"Tenant {tenant_id} registered, transit key & policies created!",
+            "steps": steps,
+            "total_ms": total_ms,
+        }
+
+    async def create_transit_key(self, tenant_id: str):
         """Create a transit key for a specific tenant."""
         key_name = f"{tenant_id}-transit"
 
         try:
-            self.client.secrets.transit.create_key(
-                name=key_name, 
-                key_type="aes256-gcm96",  # Strong encryption type
-                exportable=False,      # Prevent exporting the key
-                allow_plaintext_backup=False
+            await self.vault.request(
+                "POST", f"transit/keys/{key_name}", self.token,
+                json={
+                    "type": "aes256-gcm96",  # Strong encryption type
+                    "exportable": False,      # Prevent exporting the key
+                    "allow_plaintext_backup": False
+                }
             )
             print(f"✅ Created transit key: {key_name}")
 
@@ -149,15 +340,160 @@ class VaultClient:
                 print(f"ℹ️ Transit key '{key_name}' already exists, skipping creation.")
             else:
                 raise HTTPException(status_code=500, detail=f"Error creating transit key: {str(e)}")
-            
 
-    def rotate_transit_key(self, tenant_id: str):
+    async def rotate_transit_key(self, tenant_id: str):
         """Rotate the transit encryption key for a specific tenant."""
         key_name = f"{tenant_id}-transit"
 
         try:
-            self.client.secrets.transit.rotate_key(name=key_name)
+            # Not idempotent: a resent rotate would skip a key version
+            await self.vault.request("POST", f"transit/keys/{key_name}/rotate", self.token, idempotent=False)
             print(f"🔄 Successfully rotated transit key: {key_name}")
 
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error rotating transit key: {str(e)}")
+
+    async def read_secret(self, path: str) -> tuple[Optional[dict], int]:
+        """KV v2 secret at ``path`` and its version; (None, 0) if there is none."""
+        try:
+            response = await self.vault.request("GET", f"kv/data/{path}", self.token)
+        except VaultNotFound:
+            return None, 0
+        return response["data"]["data"], response["data"]["metadata"]["version"]
+
+    async def write_secret(self, path: str, data: dict, cas: Optional[int] = None) -> bool:
+        """Write a KV v2 secret; with ``cas``, only over that version (0: only if absent).
+
+        Returns False when the check-and-set did not match.
+        """
+        body = {"data": data}
+        if cas is not None:
+            body["options"] = {"cas": cas}
+        try:
+            await self.vault.request("POST", f"kv/data/{path}", self.token, json=body)
+        except VaultError as e:
+            if cas is not None and e.status == 400 and "check-and-set" in str(e):
+                return False
+            raise
+        return True
+
+    async def transit_key_version(self, tenant_id: str) -> int:
+        """Latest version of the tenant's transit key."""
+        response = await self.vault.request("GET", f"transit/keys/{tenant_id}-transit", self.token)
+        return response["data"]["latest_version"]
+
+    async def rewrap_batch(self, tenant_id: str, ciphertexts: List[str]) -> List[str]:
+        """Re-encrypt transit ciphertexts under the latest key version, without exposing plaintext.
+
+        One call per VAULT_TRANSIT_BATCH_SIZE items; raises ValueError
+        naming the first item Vault could not rewrap.
+        """
+        results = []
+        size = settings.VAULT_TRANSIT_BATCH_SIZE
+        for start in range(0, len(ciphertexts), size):
+            batch_input = [{"ciphertext": c} for c in ciphertexts[start:start + size]]
+            response = await self.vault.transit("rewrap", f"{tenant_id}-transit", self.token,
+                                                batch_input=batch_input)
+            for i, item in enumerate(response["batch_results"], start):
+                if item.get("error"):
+                    raise ValueError(f"Item {i}: {item['error']}")
+                results.append(item["ciphertext"])
+        return results
+
+
+class CachedToken:
+    __slots__ = ("token", "expires_at")
+
+    def __init__(self, token: str, expires_at: float):
+        self.token = token
+        self.expires_at = expires_at
+
+
+class VaultTokenCache:
+    """Role tokens per (tenant, role), read from KV once instead of per call.
+
+    Tokens are kept until shortly before they expire. A background task
+    renews the ones nearing expiry (``renew_margin`` seconds left), so
+    steady traffic never waits on a KV read. Concurrent misses on one key
+    share a single read. Callers that get a 403 with a cached token
+    ``invalidate`` it and read it again.
+    """
+
+    def __init__(self, vault_client: VaultClient, renew_margin: float, check_interval: float):
+        self.vault_client = vault_client
+        self.renew_margin = renew_margin
+        self.check_interval = check_interval
+        self._tokens: dict[tuple[str, str], CachedToken] = {}
+        self._fetching: dict[tuple[str, str], asyncio.Task] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def get(self, tenant_id: str, role: str) -> str:
+        key = (tenant_id, role)
+        cached = self._tokens.get(key)
+        if cached is not None and cached.expires_at > time.time():
+            return cached.token
+        fetching = self._fetching.get(key)
+        if fetching is None:
+            fetching = asyncio.get_running_loop().create_task(self._fetch(tenant_id, role))
+            self._fetching[key] = fetching
+            fetching.add_done_callback(lambda _: self._fetching.pop(key, None))
+        # Shielded so one caller being cancelled does not fail the others
+        return (await asyncio.shield(fetching)).token
+
+    def invalidate(self, tenant_id: str, role: str):
+        self._tokens.pop((tenant_id, role), None)
+
+    async def _fetch(self, tenant_id: str, role: str) -> CachedToken:
+        token = await self.vault_client.get_vault_token(tenant_id, role)
+        cached = CachedToken(token, time.time() + settings.VAULT_TOKEN_TTL_SECONDS)
+        try:
+            response = await self.vault_client.vault.request("GET", "auth/token/lookup-self", token)
+            cached.expires_at = time.time() + response["data"]["ttl"]
+        except Exception as e:
+            logger.warning(f"Could not look up TTL of {role} token for tenant {tenant_id}: {e}")
+        self._tokens[(tenant_id, role)] = cached
+        return cached
+
+    async def renew_expiring(self):
+        """Renew cached tokens within ``renew_margin`` of expiry; drop those that fail."""
+        deadline = time.time() + self.renew_margin
+        for key, cached in list(self._tokens.items()):
+            if cached.expires_at > deadline:
+                continue
+            try:
+                response = await self.vault_client.vault.request(
+                    "POST", "auth/token/renew-self", cached.token,
+                    json={"increment": f"{settings.VAULT_TOKEN_TTL_SECONDS}s"}
+                )
+                cached.expires_at = time.time() + response["auth"]["lease_duration"]
+            except Exception as e:
+                logger.warning(f"Could not renew {key[1]} token for tenant {key[0]}: {e}")
+                self._tokens.pop(key, None)
+
+    async def _renew_forever(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                await self.renew_expiring()
+            except Exception as e:
+                logger.error(f"Vault token renewal failed: {e}")
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._renew_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+vault_token_cache = VaultTokenCache(
+    VaultClient(),
+    renew_margin=settings.VAULT_TOKEN_RENEW_MARGIN_SECONDS,
+    check_interval=settings.VAULT_TOKEN_RENEW_CHECK_SECONDS,
+)
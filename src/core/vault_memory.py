@@ -0,0 +1,199 @@
+"""In-process stand-in for the parts of Vault this app uses.
+
+``InMemoryVault`` is an httpx transport, so ``AsyncVault`` talks to it
+exactly as it would to a server: KV v2, ACL policies, token create /
+lookup-self / renew-self / revoke-self, and transit keys, encrypt,
+decrypt, rewrap and datakey (with ``batch_input``). Policies are enforced
+on path globs and capabilities, so permission errors behave like the
+real thing. Transit uses real AES-GCM with versioned keys. ``latency``
+adds a delay to every request, for benchmarks.
+
+Enable with VAULT_IN_MEMORY=true, or pass ``InMemoryVault()`` as the
+transport of an ``AsyncVault``.
+"""
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from typing import Optional
+import asyncio
+import base64
+import fnmatch
+import json
+import os
+import re
+import secrets
+import time
+
+import httpx
+
+POLICY_RULE = re.compile(r'path\s+"([^"]+)"\s*\{\s*capabilities\s*=\s*\[([^\]]*)\]\s*\}')
+
+
+class _Error(Exception):
+    def __init__(self, status: int, message: str):
+        self.status = status
+        self.message = message
+
+
+class InMemoryVault(httpx.AsyncBaseTransport):
+    def __init__(self, root_token: str = "root", latency: float = 0.0):
+        self.root_token = root_token
+        self.latency = latency
+        self.kv: dict[str, tuple[int, dict]] = {}  # path -> (version, data)
+        self.policies: dict[str, list[tuple[str, set[str]]]] = {}
+        self.tokens: dict[str, dict] = {}
+        self.transit_keys: dict[str, list[bytes]] = {}
+        self.requests = 0
+
+    # Transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        body = json.loads(request.content) if request.content else {}
+        path = request.url.path.removeprefix("/v1/")
+        try:
+            token = self._authorize(request.headers.get("x-vault-token"), request.method, path)
+            data = self._route(request.method, path, body, token)
+        except _Error as e:
+            return httpx.Response(e.status, json={"errors": [e.message]})
+        if data is None:
+            return httpx.Response(204)
+        return httpx.Response(200, json=data)
+
+    # Auth
+
+    def _authorize(self, token: Optional[str], method: str, path: str) -> Optional[str]:
+        if token == self.root_token:
+            return token
+        info = self.tokens.get(token or "")
+        if info is None or info["expires_at"] <= time.time():
+            raise _Error(403, "permission denied")
+        if path.startswith("auth/token/") and path.endswith("-self"):
+            return token
+        needed = {"GET": {"read"}, "LIST": {"list"}, "DELETE": {"delete"}}.get(method, {"create", "update"})
+        for policy in info["policies"]:
+            for pattern, capabilities in self.policies.get(policy, ()):
+                if fnmatch.fnmatchcase(path, pattern) and capabilities & needed:
+                    return token
+        raise _Error(403, "permission denied")
+
+    # Routing
+
+    def _route(self, method: str, path: str, body: dict, token: str):
+        parts = path.split("/")
+        if parts[:2] == ["kv", "data"]:
+            return self._kv(method, "/".join(parts[2:]), body)
+        if parts[:2] == ["sys", "policy"]:
+            self.policies[parts[2]] = [
+                (pattern, {c.strip().strip('"') for c in capabilities.split(",") if c.strip()})
+                for pattern, capabilities in POLICY_RULE.findall(body["policy"])
+            ]
+            return None
+        if path == "auth/token/create":
+            return self._create_token(body)
+        if path == "auth/token/lookup-self":
+            return {"data": {"ttl": self._ttl(token)}}
+        if path == "auth/token/renew-self":
+            return self._renew(token, body)
+        if path == "auth/token/revoke-self":
+            self.tokens.pop(token, None)
+            return None
+        if parts[0] == "transit":
+            return self._transit(method, parts[1:], body)
+        raise _Error(404, f"no handler for route {path!r}")
+
+    def _kv(self, method: str, path: str, body: dict):
+        version, data = self.kv.get(path, (0, None))
+        if method == "GET":
+            if data is None:
+                raise _Error(404, "secret not found")
+            return {"data": {"data": data, "metadata": {"version": version}}}
+        cas = body.get("options", {}).get("cas")
+        if cas is not None and cas != version:
+            raise _Error(400, "check-and-set parameter did not match the current version")
+        self.kv[path] = (version + 1, body["data"])
+        return {"data": {"version": version + 1}}
+
+    # Tokens
+
+    @staticmethod
+    def _parse_ttl(value) -> int:
+        if isinstance(value, int):
+            return value
+        units = {"s": 1, "m": 60, "h": 3600}
+        return int(value[:-1]) * units[value[-1]] if value[-1] in units else int(value)
+
+    def _create_token(self, body: dict):
+        token = f"hvs.{secrets.token_urlsafe(18)}"
+        ttl = self._parse_ttl(body.get("ttl", "768h"))
+        self.tokens[token] = {"policies": body.get("policies", []), "expires_at": time.time() + ttl}
+        return {"auth": {"client_token": token, "lease_duration": ttl, "renewable": True}}
+
+    def _ttl(self, token: str) -> int:
+        if token == self.root_token:
+            return 0
+        return max(int(self.tokens[token]["expires_at"] - time.time()), 0)
+
+    def _renew(self, token: str, body: dict):
+        if token == self.root_token:
+            raise _Error(400, "root token is not renewable")
+        ttl = self._parse_ttl(body.get("increment", "24h"))
+        self.tokens[token]["expires_at"] = time.time() + ttl
+        return {"auth": {"client_token": token, "lease_duration": ttl}}
+
+    # Transit
+
+    def _transit(self, method: str, parts: list[str], body: dict):
+        operation, name = parts[0], parts[-1]
+        if operation == "keys":
+            if len(parts) == 3 and parts[2] == "rotate":
+                self._versions(parts[1]).append(AESGCM.generate_key(256))
+                return None
+            if method == "GET":
+                versions = self._versions(name)
+                return {"data": {"name": name, "latest_version": len(versions),
+                                 "min_decryption_version": 1}}
+            self.transit_keys.setdefault(name, [AESGCM.generate_key(256)])
+            return None
+        if operation == "datakey":
+            plaintext = os.urandom(32)
+            return {"data": {"plaintext": base64.b64encode(plaintext).decode(),
+                             "ciphertext": self._seal(name, plaintext)}}
+        handlers = {
+            "encrypt": lambda item: {"ciphertext": self._seal(name, base64.b64decode(item["plaintext"]))},
+            "decrypt": lambda item: {"plaintext": base64.b64encode(self._open(name, item["ciphertext"])).decode()},
+            "rewrap": lambda item: {"ciphertext": self._seal(name, self._open(name, item["ciphertext"]))},
+        }
+        if operation not in handlers:
+            raise _Error(404, f"unsupported transit operation {operation!r}")
+        handler = handlers[operation]
+        if "batch_input" in body:
+            results = []
+            for item in body["batch_input"]:
+                try:
+                    results.append(handler(item))
+                except _Error as e:
+                    results.append({"error": e.message})
+            return {"data": {"batch_results": results}}
+        return {"data": handler(body)}
+
+    def _versions(self, name: str) -> list[bytes]:
+        if name not in self.transit_keys:
+            raise _Error(400, "encryption key not found")
+        return self.transit_keys[name]
+
+    def _seal(self, name: str, plaintext: bytes) -> str:
+        versions = self._versions(name)
+        nonce = os.urandom(12)
+        sealed = AESGCM(versions[-1]).encrypt(nonce, plaintext, None)
+        return f"vault:v{len(versions)}:{base64.b64encode(nonce + sealed).decode()}"
+
+    def _open(self, name: str, ciphertext: str) -> bytes:
+        versions = self._versions(name)
+        try:
+            _, version, payload = ciphertext.split(":", 2)
+            key = versions[int(version.removeprefix("v")) - 1]
+            raw = base64.b64decode(payload)
+            return AESGCM(key).decrypt(raw[:12], raw[12:], None)
+        except Exception:
+            raise _Error(400, "invalid ciphertext")
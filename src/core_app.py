@@ -5,10 +5,18 @@ from contextlib import asynccontextmanager
 from fastapi.middleware import Middleware
 from core.middleware import TenantMiddleware  # Import class-based middleware
 from core.config import settings
-from core.database import engine, PublicBase
+from core.security import password_hasher
+from core.revocation import revocation_store
+from core.redis_client import close_redis
+from core.vault_client import vault_http, vault_token_cache
+from core.rewrap import reindex_jobs, rewrap_jobs
+from core.tenant_upgrades import upgrade_tenant_schemas
+from core.database import engine, replicas, pool_prober, PublicBase
 from sqlalchemy import text
 from core.models import *
 from core.utils.setup import load_compliance_data, load_plans_data
+from core.tenant_cache import known_hosts
+from core.invalidation import invalidation_bus
 from fastapi.responses import JSONResponse
 from fastapi.exceptions import RequestValidationError
 @asynccontextmanager
@@ -27,7 +35,27 @@ async def lifespan(app: FastAPI):
         await load_compliance_data()
         await load_plans_data()
 
+    # Columns added to tenant tables since those tenants were created
+    await upgrade_tenant_schemas()
+
+    await known_hosts.rebuild()
+    await invalidation_bus.start()
+    await replicas.start()
+    await pool_prober.start()
+    await revocation_store.start()
+    await vault_token_cache.start()
+
     yield
+    await rewrap_jobs.stop()
+    await reindex_jobs.stop()
+    await vault_token_cache.stop()
+    await revocation_store.stop()
+    await pool_prober.stop()
+    await replicas.stop()
+    await invalidation_bus.stop()
+    password_hasher.shutdown()
+    await close_redis()
+    await vault_http.aclose()
     await engine.dispose()
 
 def create_app() -> FastAPI:
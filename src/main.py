@@ -10,7 +10,7 @@ from modules.routes import (auth,
                             appointment,
                               location, 
                               user_created_by_admin, 
-                              department, clinic, role, user_details)
+                              department, clinic, role, user_details, internal)
 from core.ai import department_matcher
 app = create_app()
 
@@ -27,6 +27,7 @@ app.include_router(user_created_by_admin.router)
 app.include_router(role.router)
 app.include_router(user_details.router)
 app.include_router(department_matcher.router)
+app.include_router(internal.router)
 
 @app.get("/health")
 async def health_check():
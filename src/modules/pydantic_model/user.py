@@ -1,4 +1,4 @@
-from pydantic import BaseModel, validator, EmailStr
+from pydantic import BaseModel, Field, validator, EmailStr
 from datetime import date, datetime
 from typing import Union, Optional, Dict
 
@@ -14,7 +14,7 @@ class UserCreate(BaseModel):
     phone_number: str  
     dob: Union[date, datetime, str]
     gender: str
-    license_number: Optional[str] = None  
+    license_number: Optional[str] = Field(None, max_length=100)
     specialty: Optional[str] = None
     qualifications: Optional[Dict] = None 
     availability: Optional[Dict] = None
@@ -6,7 +6,7 @@ from sqlalchemy.orm import selectinload
 from pydantic import BaseModel, validator
 from datetime import datetime, timedelta
 from typing import List, Optional
-from core.dependencies import get_tenant_user, get_db
+from core.dependencies import get_tenant_user, get_db, get_read_db, get_uow_db, require_permission
 from core.models.tenant import Appointment, AppointmentReminder, Waitlist, Patient, Provider, Service, User
 from core.models.public import AuditLog
 
@@ -137,12 +137,9 @@ async def handle_waitlist(appointment: Appointment, db: AsyncSession):
 async def create_appointment(
     appointment: AppointmentCreate,
     request: Request,
-    db: AsyncSession = Depends(get_db),
-    user: User = Depends(get_tenant_user)
+    db: AsyncSession = Depends(get_uow_db, scope="function"),
+    user: User = Depends(require_permission("appointment.create"))
 ):
-    # Authorization
-    if user.role.name not in ["clinic_admin", "staff"]:
-        raise HTTPException(403, "Insufficient permissions")
 
     # Check provider exists
     provider = await db.get(Provider, appointment.provider_id)
@@ -200,7 +197,7 @@ async def update_appointment(
     appointment_id: int,
     update_data: AppointmentUpdate,
     request: Request,
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_uow_db, scope="function"),
     user: User = Depends(get_tenant_user)
 ):
     appt = await db.get(Appointment, appointment_id)
@@ -220,7 +217,7 @@ async def update_appointment(
     # Handle cancellation
     if update_data.status == "canceled":
         if appt.start_time < datetime.now() + timedelta(hours=24):
-            if user.role.name != "clinic_admin":
+            if not user.has("appointment.cancel_late"):
                 raise HTTPException(403, "Cancellations within 24hr require admin approval")
         
         # Process waitlist
@@ -343,7 +340,7 @@ def get_event_title(appointment: Appointment, user: User) -> str:
     return f"{appointment.patient.full_name} - {appointment.provider.full_name}"
 
 def check_edit_permissions(user: User, appointment: Appointment) -> bool:
-    if user.role.name in ["clinic_admin", "staff"]:
+    if user.has("appointment.edit_any"):
         return True
     if user.role.name == "provider" and appointment.provider_id == user.provider_id:
         return appointment.status == "scheduled"
@@ -389,7 +386,7 @@ async def create_audit_log(request, user, action, details, db):
 async def get_calendar_view(
     start_date: datetime = Query(..., description="Start date in UTC"),
     end_date: datetime = Query(..., description="End date in UTC"),
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
     user: User = Depends(get_tenant_user)
 ):
     # Validate date range
@@ -432,13 +429,13 @@ async def get_calendar_view(
             color=STATUS_COLORS.get(appt.status, "#9E9E9E"),
             status=appt.status,
             location=appt.location.name if appt.location else None,
-            notes=appt.notes if user.role.name in ["clinic_admin", "staff"] else None,
+            notes=appt.notes if user.has("appointment.view_notes") else None,
             can_edit=check_edit_permissions(user, appt),
             conflict=conflict
         )
 
         # Add participants for admins
-        if user.role.name == "clinic_admin":
+        if user.has("appointment.view_participants"):
             event.participants = [
                 f"Patient: {appt.patient.full_name}",
                 f"Provider: {appt.provider.full_name}"
@@ -447,7 +444,7 @@ async def get_calendar_view(
         events.append(event)
 
     # Add availability slots for admins/staff
-    if user.role.name in ["clinic_admin", "staff"]:
+    if user.has("schedule.view_availability"):
         events += await get_provider_availability(start_date, end_date, db)
     
     return events
@@ -458,7 +455,7 @@ async def reschedule_appointment(
     new_start: datetime,
     new_end: datetime,
     request: Request,
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_uow_db, scope="function"),
     user: User = Depends(get_tenant_user)
 ):
     appt = await db.get(Appointment, appointment_id)
@@ -5,9 +5,12 @@ from sqlalchemy.exc import IntegrityError
 from core.dependencies import get_db, get_tenant_user, get_current_admin
 from core.models.tenant import User, Role
 from sqlalchemy import select
+from sqlalchemy.orm import joinedload
 from modules.pydantic_model.auth_schemas import UserCreate, UserResponse, UserLogin, Token
-from core.security import get_password_hash, verify_password, create_access_token
+from core.security import get_password_hash_async, verify_password_async, create_access_token
 from core.dependencies import get_current_user
+from core.principal import Principal, principal_claims
+from core.revocation import revocation_store
 import json
 
 router = APIRouter(prefix="/auth", tags=["Authentication"])
@@ -44,7 +47,7 @@ async def signup(
 
     new_user = User(
         email=user_data.email,
-        password_hash=get_password_hash(user_data.password),
+        password_hash=await get_password_hash_async(user_data.password),
         tenant_id=tenant.id if tenant else None,
         role_id=role.id,
         is_active=True
@@ -58,13 +61,8 @@ async def signup(
         await db.rollback()  # Rollback to clean up the session
         raise HTTPException(400, "Email already exists in this tenant context")
 
-    token_data = {
-        "sub": str(new_user.id),
-        "tenant_id": str(new_user.tenant_id) if new_user.tenant_id else "public"
-    }
-
     return {
-        "access_token": create_access_token(token_data),
+        "access_token": create_access_token(principal_claims(new_user, role)),
         "token_type": "bearer"
     }
 
@@ -78,7 +76,7 @@ async def login(
     tenant = getattr(request.state, "tenant", None)
     
     # Construct query with proper schema context
-    query = select(User).filter_by(email=form_data.username)
+    query = select(User).options(joinedload(User.role)).filter_by(email=form_data.username)
     
     if tenant:
         query = query.where(User.tenant_id == tenant.id)
@@ -89,18 +87,13 @@ async def login(
         result = await db.execute(query)
         user = result.scalars().first()
         
-        if not user or not verify_password(form_data.password, user.password_hash):
+        if not user or not await verify_password_async(form_data.password, user.password_hash):
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid credentials"
             )
             
-        access_token = create_access_token(
-            data={
-                "sub": str(user.id),
-                "tenant_id": str(user.tenant_id) if user.tenant_id else "public"
-            }
-        )
+        access_token = create_access_token(principal_claims(user, user.role))
         
         return {"access_token": access_token, "token_type": "bearer"}
         
@@ -111,8 +104,27 @@ async def login(
             detail="Internal server error"
         )
     
+@router.post("/logout")
+async def logout(request: Request, user: Principal = Depends(get_current_user)):
+    try:
+        await revocation_store.revoke_token(request.state.token_claims)
+    except Exception:
+        # Revoked on this worker only; the client should retry.
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Logout could not be completed, please try again"
+        )
+    return {"detail": "Logged out"}
+
 @router.get("/me", response_model=UserResponse)
-async def get_me(user: User = Depends(get_tenant_user)):
+async def get_me(
+    principal: Principal = Depends(get_tenant_user),
+    db: AsyncSession = Depends(get_db)
+):
+    # The principal only carries the token claims; the profile needs the row.
+    user = (await db.execute(select(User).where(User.id == principal.id))).scalars().first()
+    if not user:
+        raise HTTPException(404, "User not found")
     return user
 
 
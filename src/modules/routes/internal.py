@@ -0,0 +1,63 @@
+from fastapi import APIRouter, Depends, HTTPException
+from core.dependencies import internal_route_required
+from core.database import pool_prober
+from core.metrics import metrics
+from core.query_stats import query_stats
+from core.blind_index import blind_index_keys
+from core.rewrap import reindex_jobs, rewrap_jobs
+from core.vault_client import VaultClient
+
+router = APIRouter(
+    prefix="/internal",
+    tags=["internal"],
+    dependencies=[Depends(internal_route_required)],
+    include_in_schema=False,
+)
+
+@router.get("/metrics")
+async def get_metrics():
+    return metrics.snapshot()
+
+@router.get("/pool")
+async def get_pool_stats():
+    return pool_prober.stats()
+
+@router.get("/query-stats")
+async def get_query_stats():
+    return {
+        "slow_threshold_ms": query_stats.slow_threshold_ms,
+        "routes": query_stats.snapshot(),
+    }
+
+@router.post("/query-stats/reset")
+async def reset_query_stats():
+    query_stats.reset()
+    return {"status": "ok"}
+
+@router.post("/rewrap/{tenant_id}", status_code=202)
+async def start_rewrap(tenant_id: int, rotate: bool = False):
+    """Rewrap the tenant's ciphertexts onto its latest transit key, rotating it first if asked."""
+    if rotate:
+        await VaultClient().rotate_transit_key(str(tenant_id))
+    return rewrap_jobs.start(str(tenant_id)).status()
+
+@router.get("/rewrap/{tenant_id}")
+async def get_rewrap_status(tenant_id: int):
+    job = rewrap_jobs.get(str(tenant_id))
+    if job is None:
+        raise HTTPException(status_code=404, detail="No rewrap job for this tenant")
+    return job.status()
+
+@router.post("/blind-index/{tenant_id}", status_code=202)
+async def start_reindex(tenant_id: int, rotate: bool = False):
+    """Bring the tenant's blind indexes onto its current key, rotating it first if asked."""
+    if rotate:
+        await blind_index_keys.rotate(str(tenant_id))
+    return reindex_jobs.start(str(tenant_id)).status()
+
+@router.get("/blind-index/{tenant_id}")
+async def get_reindex_status(tenant_id: int):
+    job = reindex_jobs.get(str(tenant_id))
+    if job is None:
+        raise HTTPException(status_code=404, detail="No blind-index job for this tenant")
+    return job.status()
@@ -2,11 +2,12 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Request
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
 from datetime import date
 from typing import List, Optional
 from datetime import datetime
-from core.dependencies import get_tenant_user, get_db
+from core.dependencies import get_tenant_user, get_db, get_read_db, get_uow_db
+from core.encrypted_column import blind_index_match
 from core.models.public import AuditLog
 from core.models.tenant import Patient,User
 
@@ -26,7 +27,7 @@ class PatientBase(BaseModel):
     policy_number: Optional[str] = None
 
 class PatientCreate(PatientBase):
-    encrypted_ssn: str  # Should come from secure encryption in frontend
+    encrypted_ssn: str = Field(..., max_length=200)  # Encrypted at rest by EncryptedString
 
 class PatientUpdate(BaseModel):
     first_name: Optional[str] = None
@@ -36,6 +37,9 @@ class PatientUpdate(BaseModel):
     insurance_provider: Optional[str] = None
     policy_number: Optional[str] = None
 
+class PatientLookup(BaseModel):
+    ssn: str
+
 class PatientResponse(PatientBase):
     id: int
     created_at: datetime
@@ -48,7 +52,7 @@ class PatientResponse(PatientBase):
 async def create_patient(
     patient_data: PatientCreate,
     request: Request,
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_uow_db, scope="function"),
     user: User = Depends(get_tenant_user)
 ):
     # Role check
@@ -102,7 +106,7 @@ async def update_patient(
     patient_id: int,
     update_data: PatientUpdate,
     request: Request,
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_uow_db, scope="function"),
     user: User = Depends(get_tenant_user)
 ):
     # if user.role.name not in ["clinic_admin", "staff"]:
@@ -140,10 +144,10 @@ async def update_patient(
 async def delete_patient(
     patient_id: int,
     request: Request,
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_uow_db, scope="function"),
     user: User = Depends(get_tenant_user)
 ):
-    if user.role.name != "clinic_admin":
+    if not user.has("patient.delete"):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Only clinic admins can delete patients"
@@ -172,7 +176,7 @@ async def list_patients(
     insurance_provider: Optional[str] = None,
     skip: int = 0,
     limit: int = 100,
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
     user: User = Depends(get_tenant_user)
 ):
     query = select(Patient)
@@ -190,4 +194,17 @@ async def list_patients(
 
     result = await db.execute(query.offset(skip).limit(limit))
     patients = result.scalars().all()
-    return patients
\ No newline at end of file
+    return patients
+
+# POST so the SSN stays out of URLs and access logs
+@router.post("/lookup", response_model=List[PatientResponse])
+async def lookup_patients(
+    lookup: PatientLookup,
+    db: AsyncSession = Depends(get_read_db),
+    user: User = Depends(get_tenant_user)
+):
+    # Exact match through the SSN blind index; one index scan, no decryption
+    result = await db.execute(
+        select(Patient).where(await blind_index_match(Patient.encrypted_ssn, lookup.ssn))
+    )
+    return result.scalars().all()
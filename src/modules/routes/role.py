@@ -5,6 +5,7 @@ from sqlalchemy import select
 
 from core.models.tenant import User, Role
 from core.dependencies import get_db, get_current_user, get_current_admin
+from core.cache import cached_select
 
 from pydantic import BaseModel
 from typing import Optional, List
@@ -35,11 +36,8 @@ async def get_roles(
     user: User = Depends(get_current_user)
 ):
     try:
-        query = select(Role)
-        result = await db.execute(query)
-        roles = result.scalars().all()
-
-        return roles
+        return await cached_select(db, select(Role), RoleOut, namespace="roles", key="all",
+                                   tags=("roles",))
     
     except HTTPException as e:
         raise e
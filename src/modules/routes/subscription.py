@@ -6,7 +6,7 @@ from core.dependencies import get_db
 from core.models.tenant import  User, Role
 from core.models.public import Tenant, Transaction, Plan
 from ..pydantic_model.subs import TenantCreate, SubscriptionCreate, SubscriptionResponse, UserCreate, UserResponse
-from core.security import get_password_hash, create_access_token
+from core.security import get_password_hash_async, create_access_token
 from core.dependencies import get_current_user
 from core.utils.email_sms import send_credentials_email
 from modules.services.razorpay_services import RazorpayService
@@ -15,6 +15,7 @@ from sqlalchemy import text
 from core.models.tenant import Provider
 from core.database import TenantAwareBase, tenant_schema, PublicBase
 from core.vault_client import VaultClient
+from core.tenant_cache import known_hosts
 import json
 settings = Settings()
 vault = VaultClient()
@@ -104,7 +105,7 @@ async def subscribe(
         await db.flush()
 
         admin_password = "test@12346789"
-        hashed_password = get_password_hash(admin_password)
+        hashed_password = await get_password_hash_async(admin_password)
         clinic_admin = (await db.execute(select(Role).where(Role.name == "clinic_admin"))).scalar()
         if not clinic_admin:
             raise HTTPException(status_code=500, detail="clinic_admin role not found")
@@ -119,7 +120,10 @@ async def subscribe(
         await db.flush()
 
         await db.commit()
-        
+
+        # Make the new tenant's host resolvable on this worker right away
+        await known_hosts.rebuild()
+
 
     except Exception as e:
         await db.rollback()
@@ -2,9 +2,9 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.ext.asyncio import AsyncSession
 from core.models.tenant import User, Role, Department, Location, Provider, Patient
 from sqlalchemy import select, case, or_, func
-from core.dependencies import get_db, get_current_admin
+from core.dependencies import get_db, get_read_db, get_current_admin
 from ..pydantic_model.user import UserCreate, UserResponse
-from core.security import get_password_hash
+from core.security import get_password_hash_async
 from sqlalchemy.exc import SQLAlchemyError
 
 
@@ -56,7 +56,7 @@ async def create_user(
         # Create user and provider in one transaction
         new_user = User(
             email=user_data.email,
-            password_hash=get_password_hash(user_data.password),
+            password_hash=await get_password_hash_async(user_data.password),
             role_id=user_data.role_id,
             tenant_id=admin.tenant_id
         )
@@ -108,7 +108,7 @@ async def get_users(
     location_id: Optional[int] = Query(None, description="Filter by location ID"),
     is_provider: Optional[bool] = Query(None, description="Filter by provider status"),
     is_patient: Optional[bool] = Query(None, description="Filter by patient status"),
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
     user: User = Depends(get_current_admin)
 ):
     # Create aliases for joined tables
@@ -4,6 +4,7 @@ from sqlalchemy.orm import selectinload
 from sqlalchemy.future import select
 from core.dependencies import get_db, get_current_admin
 from core.models.tenant import User, Provider, Patient, Department, Location, Clinic
+from core.encrypted_column import reveal
 from pydantic import BaseModel
 from typing import Optional
 from datetime import datetime
@@ -79,7 +80,7 @@ async def get_provider_by_user(
         "phone_number": provider.phone_number,
         "dob": provider.dob,
         "gender": provider.gender,
-        "license_number": provider.license_number,
+        "license_number": await reveal(provider.license_number),
         "specialty": provider.specialty,
         "qualifications": provider.qualifications or {},
         "availability": provider.availability or {},
@@ -117,7 +118,7 @@ async def get_patient_by_user(
         "phone_number": patient.phone_number,
         "date_of_birth": patient.date_of_birth,
         "gender": patient.gender,
-        "encrypted_ssn": patient.encrypted_ssn,
+        "encrypted_ssn": await reveal(patient.encrypted_ssn),
         "insurance_provider": patient.insurance_provider,
         "policy_number": patient.policy_number,
         "clinic": patient.clinic.name if patient.clinic else None,